@@ -402,6 +402,61 @@ class BlendFileBlock:
                 use_nil=use_nil, use_str=use_str,
                 )
 
+    def get_array(self, path,
+            sdna_index_refine=None,
+            use_nil=True, use_str=True,
+            ):
+        """
+        Return a list with the value of ``path`` for each struct in this block (``self.count`` items).
+
+        The same as calling ``get`` with every ``base_index``,
+        but the block is read at once instead of seeking to each item.
+        """
+        if sdna_index_refine is None:
+            sdna_index_refine = self.sdna_index
+        else:
+            self.file.ensure_subtype_smaller(self.sdna_index, sdna_index_refine)
+
+        header = self.file.header
+        handle = self.file.handle
+        handle.seek(self.file_offset, os.SEEK_SET)
+
+        dna_struct = self.file.structs[sdna_index_refine]
+        field = dna_struct.field_from_path(header, handle, path)
+        if field is None:
+            raise KeyError("%r not found in %r (%r)" % (path, [f.dna_name.name_only for f in dna_struct.fields], dna_struct.dna_type_id))
+        if self.count == 0:
+            return []
+
+        stride = self.size // self.count
+        offsets = range(handle.tell() - self.file_offset, stride * self.count, stride)
+        handle.seek(self.file_offset, os.SEEK_SET)
+        data = handle.read(self.size)
+
+        dna_type = field.dna_type
+        dna_name = field.dna_name
+
+        if dna_name.is_pointer:
+            st = (DNA_IO.UINT if header.pointer_size == 4 else DNA_IO.ULONG)[header.endian_index]
+        elif dna_type.dna_type_id == b'int':
+            st = DNA_IO.SINT[header.endian_index]
+        elif dna_type.dna_type_id == b'short':
+            st = DNA_IO.SSHORT[header.endian_index]
+        elif dna_type.dna_type_id == b'float':
+            st = struct.Struct(header.endian_str + b'f')
+        elif dna_type.dna_type_id == b'char':
+            size = dna_name.array_size
+            values = [data[ofs:ofs + size] for ofs in offsets]
+            if use_nil:
+                values = [DNA_IO.read_data0(value) for value in values]
+            if use_str:
+                values = [value.decode('utf-8') for value in values]
+            return values
+        else:
+            raise NotImplementedError("%r exists but isn't pointer, can't resolve field %r" % (path, dna_name.name_only))
+
+        return [st.unpack_from(data, ofs)[0] for ofs in offsets]
+
     def set(self, path, value,
             sdna_index_refine=None,
             ):
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+"""
+Block level delta transfer.
+
+The client sends a signature of its cached copy of a file,
+the server replies with a list of operations to rebuild the new file,
+copying unchanged regions from the cached copy.
+
+Blend files are split on block boundaries (starting a new chunk at each ID block),
+so inserting or removing data only changes the chunks it touches.
+
+Other files (or gzipped blend files) use fixed size chunks,
+these never re-synchronize after data is inserted or removed
+(only edits which keep the rest of the file in place can be reused),
+so clients should only request deltas for files where ``is_delta_supported`` is true.
+"""
+
+import os
+
+# don't make chunks smaller than this (unless we're at the end of the file).
+CHUNK_SIZE_MIN = 1 << 16
+# split blocks larger than this.
+CHUNK_SIZE_MAX = 1 << 22
+# chunk size for non blend-files.
+CHUNK_SIZE_FIXED = 1 << 20
+
+
+def is_delta_supported(filepath):
+    """
+    Only (uncompressed) blend files are chunked so changes can be found after an insertion.
+    """
+    with open(filepath, 'rb') as handle:
+        return handle.read(7) == b'BLENDER'
+
+
+def _chunk_bounds_fixed(size):
+    ofs = 0
+    while ofs < size:
+        ofs_next = min(ofs + CHUNK_SIZE_FIXED, size)
+        yield ofs, ofs_next - ofs
+        ofs = ofs_next
+
+
+def _iter_block_offsets(handle):
+    """
+    Yield (offset, code) for every block header in a blend file,
+    the last item is the 'ENDB' block.
+    """
+    from bam.blend import blendfile
+
+    header = blendfile.BlendFileHeader(handle)
+    block_header_struct = header.create_block_header_struct()
+
+    ofs = handle.tell()
+    while True:
+        data = handle.read(block_header_struct.size)
+        if len(data) < 8:
+            return
+        code = data[:4].partition(b'\0')[0]
+        yield ofs, code
+        if code == b'ENDB' or len(data) != block_header_struct.size:
+            return
+        ofs += block_header_struct.size + block_header_struct.unpack(data)[1]
+        handle.seek(ofs, os.SEEK_SET)
+
+
+def _chunk_bounds_blend(handle, size):
+    # candidate split points, ID blocks (not 'DATA') begin a new data-block.
+    cuts = [0]
+    for ofs, code in _iter_block_offsets(handle):
+        if ofs - cuts[-1] >= CHUNK_SIZE_MAX:
+            cuts.append(ofs)
+        elif code != b'DATA' and ofs - cuts[-1] >= CHUNK_SIZE_MIN:
+            cuts.append(ofs)
+    cuts.append(size)
+
+    for ofs, ofs_next in zip(cuts, cuts[1:]):
+        # very large blocks
+        while ofs_next - ofs > CHUNK_SIZE_MAX:
+            yield ofs, CHUNK_SIZE_MAX
+            ofs += CHUNK_SIZE_MAX
+        if ofs_next != ofs:
+            yield ofs, ofs_next - ofs
+
+
+def chunk_bounds(filepath):
+    """
+    Return a list of (offset, size) pairs which cover the entire file.
+    """
+    with open(filepath, 'rb') as handle:
+        handle.seek(0, os.SEEK_END)
+        size = handle.tell()
+        handle.seek(0, os.SEEK_SET)
+
+        if handle.read(7) == b'BLENDER':
+            handle.seek(0, os.SEEK_SET)
+            return list(_chunk_bounds_blend(handle, size))
+        else:
+            return list(_chunk_bounds_fixed(size))
+
+
+def _iter_chunks(filepath):
+    """
+    Yield (offset, data) for each chunk.
+    """
+    bounds = chunk_bounds(filepath)
+    with open(filepath, 'rb') as handle:
+        for ofs, size in bounds:
+            handle.seek(ofs, os.SEEK_SET)
+            yield ofs, handle.read(size)
+
+
+def _chunk_digest(data):
+    import hashlib
+    return hashlib.sha1(data).hexdigest()
+
+
+def signature_from_file(filepath):
+    """
+    Returns a JSON compatible signature: [[size, digest], ...]
+    """
+    return [[len(data), _chunk_digest(data)] for ofs, data in _iter_chunks(filepath)]
+
+
+def delta_from_signature(filepath, signature):
+    """
+    Yield operations to create ``filepath`` from a file with the given ``signature``.
+
+    - ``(b'COPY', offset, size)`` copy a region of the existing file.
+    - ``(b'DATA', data)`` new data.
+
+    Adjacent operations of the same kind are merged.
+    """
+
+    # {digest: offset}
+    offset_from_digest = {}
+    ofs = 0
+    for size, digest in signature:
+        offset_from_digest.setdefault((size, digest), ofs)
+        ofs += size
+    del ofs
+
+    op_copy = None
+    op_data = []
+    op_data_size = 0
+
+    for ofs, data in _iter_chunks(filepath):
+        ofs_src = offset_from_digest.get((len(data), _chunk_digest(data)))
+        if ofs_src is not None:
+            if op_data:
+                yield (b'DATA', b''.join(op_data))
+                op_data.clear()
+                op_data_size = 0
+            if op_copy is not None and op_copy[1] + op_copy[2] == ofs_src:
+                op_copy[2] += len(data)
+            else:
+                if op_copy is not None:
+                    yield tuple(op_copy)
+                op_copy = [b'COPY', ofs_src, len(data)]
+        else:
+            if op_copy is not None:
+                yield tuple(op_copy)
+                op_copy = None
+            op_data.append(data)
+            op_data_size += len(data)
+            if op_data_size >= CHUNK_SIZE_MAX:
+                yield (b'DATA', b''.join(op_data))
+                op_data.clear()
+                op_data_size = 0
+
+    if op_copy is not None:
+        yield tuple(op_copy)
+    if op_data:
+        yield (b'DATA', b''.join(op_data))
@@ -95,10 +95,6 @@ def _relpath_remap(
 
 
 def pack(
-        # store the blendfile relative to this directory, can be:
-        #    os.path.dirname(blendfile_src)
-        # but in some cases we wan't to use a path higher up.
-        # base_dir_src,
         blendfile_src, blendfile_dst, mode='FILE',
         paths_remap_relbase=None,
         deps_remap=None, paths_remap=None, paths_uuid=None,
@@ -130,6 +126,16 @@ def pack(
         # {file: [(ofs, bytes), ...], ...}
         # ... where the file is the relative 'packed' location.
         binary_edits=None,
+
+        # A previous archive of the same blend file (ZIP mode only),
+        # entries for files which haven't changed are copied without recompressing.
+        zip_base=None,
+
+        # store the blendfile relative to this directory, defaults to:
+        #    os.path.dirname(blendfile_src)
+        # but in some cases we wan't to use a path higher up.
+        # 'blendfile_dst' is then expected to be at the same location relative to the output.
+        base_dir_src=None,
         ):
     """
     :param deps_remap: Store path deps_remap info as follows.
@@ -178,8 +184,15 @@ def pack(
         import time
         t = time.time()
 
-    base_dir_src = os.path.dirname(blendfile_src)
-    base_dir_dst = os.path.dirname(blendfile_dst)
+    if base_dir_src is None:
+        base_dir_src = os.path.dirname(blendfile_src)
+        base_dir_dst = os.path.dirname(blendfile_dst)
+    else:
+        base_dir_src = os.path.normpath(os.path.abspath(base_dir_src))
+        # the destination mirrors the source layout
+        base_dir_dst = os.path.normpath(os.path.join(
+                os.path.dirname(blendfile_dst),
+                os.path.relpath(base_dir_src, os.path.dirname(blendfile_src))))
     # _dbg(blendfile_src)
     # _dbg(blendfile_dst)
 
@@ -188,6 +201,22 @@ def pack(
     else:
         base_dir_dst_temp = os.path.join(base_dir_dst, b'__blendfile_pack__')
 
+    # {dirname: fp_basedir_conv}
+    #
+    # The location a directory is remapped to, shared by all blend files (at all levels)
+    # since it only depends on the directory ('base_dir_src' & 'blendfile_src_dir_fakeroot' don't change).
+    fp_basedir_conv_cache = {}
+
+    def fp_basedir_conv_from_dir(basedir):
+        """
+        Remap a blend files directory to the location it will end up (so we can get images relative to _that_)
+        """
+        fp_basedir_conv = fp_basedir_conv_cache.get(basedir)
+        if fp_basedir_conv is None:
+            fp_basedir_conv = _relpath_remap(os.path.join(basedir, b'dummy'), base_dir_src, base_dir_src, blendfile_src_dir_fakeroot)[0]
+            fp_basedir_conv = fp_basedir_conv_cache[basedir] = os.path.join(base_dir_src, os.path.dirname(fp_basedir_conv))
+        return fp_basedir_conv
+
     def temp_remap_cb(filepath, rootdir):
         """
         Create temp files in the destination path.
@@ -200,10 +229,8 @@ def pack(
 
         # ...
 
-        # first remap this blend file to the location it will end up (so we can get images relative to _that_)
-        # TODO(cam) cache the results
-        fp_basedir_conv = _relpath_remap(os.path.join(rootdir, b'dummy'), base_dir_src, base_dir_src, blendfile_src_dir_fakeroot)[0]
-        fp_basedir_conv = os.path.join(base_dir_src, os.path.dirname(fp_basedir_conv))
+        # first remap this blend file to the location it will end up
+        fp_basedir_conv = fp_basedir_conv_from_dir(rootdir)
 
         # then get the file relative to the new location
         filepath_tmp = _relpath_remap(filepath, base_dir_src, fp_basedir_conv, blendfile_src_dir_fakeroot)[0]
@@ -288,6 +315,8 @@ def pack(
 
     lib_visit = {}
     fp_blend_basename_last = b''
+    # directories are listed once to find sequences
+    dir_index = blendfile_path_walker.DirectoryIndex()
 
     for fp, (rootdir, fp_blend_basename) in blendfile_path_walker.FilePath.visit_from_blend(
             blendfile_src,
@@ -340,10 +369,8 @@ def pack(
         # assert(b'..' not in path_src)
         assert(b'..' not in base_dir_src)
 
-        # first remap this blend file to the location it will end up (so we can get images relative to _that_)
-        # TODO(cam) cache the results
-        fp_basedir_conv = _relpath_remap(fp_blend, base_dir_src, base_dir_src, blendfile_src_dir_fakeroot)[0]
-        fp_basedir_conv = os.path.join(base_dir_src, os.path.dirname(fp_basedir_conv))
+        # first remap this blend file to the location it will end up
+        fp_basedir_conv = fp_basedir_conv_from_dir(os.path.dirname(fp_blend))
 
         # then get the file relative to the new location
         path_dst, path_dst_final = _relpath_remap(path_src, base_dir_src, fp_basedir_conv, blendfile_src_dir_fakeroot)
@@ -364,7 +391,7 @@ def pack(
             path_copy_files.add((path_src, path_dst))
 
             for file_list in (
-                    blendfile_path_walker.utils.find_sequence_paths(path_src) if fp.is_sequence else (),
+                    blendfile_path_walker.utils.find_sequence_paths(path_src, dir_index=dir_index) if fp.is_sequence else (),
                     fp.files_siblings(),
                     ):
 
@@ -382,7 +409,7 @@ def pack(
                     fp_blend_basename.decode('utf-8'),
                     {})[path_dst_final.decode('utf-8')] = path_src_orig.decode('utf-8')
 
-    del lib_visit, fp_blend_basename_last
+    del lib_visit, fp_blend_basename_last, dir_index
 
     if TIMEIT:
         print("  Time: %.4f\n" % (time.time() - t))
@@ -413,7 +440,7 @@ def pack(
             # TODO. relative to project-basepath
             paths_remap[os.path.relpath(dst, base_dir_dst).decode('utf-8')] = relbase(src).decode('utf-8')
         # main file XXX, should have better way!
-        paths_remap[os.path.basename(blendfile_src).decode('utf-8')] = relbase(blendfile_src).decode('utf-8')
+        paths_remap[os.path.relpath(blendfile_src, base_dir_src).decode('utf-8')] = relbase(blendfile_src).decode('utf-8')
 
         # blend libs
         for dst in path_temp_files:
@@ -433,7 +460,7 @@ def pack(
                 paths_uuid[os.path.relpath(dst, base_dir_dst).decode('utf-8')] = uuid_from_file(src)
         # XXX, better way to store temp target
         blendfile_dst_tmp = temp_remap_cb(blendfile_src, base_dir_src)
-        paths_uuid[os.path.basename(blendfile_src).decode('utf-8')] = uuid_from_file(blendfile_dst_tmp)
+        paths_uuid[os.path.relpath(blendfile_src, base_dir_src).decode('utf-8')] = uuid_from_file(blendfile_dst_tmp)
 
         # blend libs
         for dst in path_temp_files:
@@ -483,10 +510,32 @@ def pack(
         _compress_level_orig = zlib.Z_DEFAULT_COMPRESSION
         zlib.Z_DEFAULT_COMPRESSION = compress_level
         _compress_mode = zipfile.ZIP_STORED if (compress_level == 0) else zipfile.ZIP_DEFLATED
-        if _compress_mode == zipfile.ZIP_STORED:
-            is_compressed_filetype = lambda fn: False
-        else:
-            from bam.utils.system import is_compressed_filetype
+        from bam.utils.system import zip_compress_type, zip_copy_raw, zip_entry_matches_file
+
+        zip_base_handle = None
+        if zip_base is not None:
+            try:
+                zip_base_handle = zipfile.ZipFile(zip_base.decode('utf-8'), 'r')
+            except (OSError, zipfile.BadZipFile):
+                yield report("  %s: %r\n" % (colorize("archive ignored", color='red'), zip_base))
+
+        def zip_base_entry(src, arcname):
+            """
+            Return the entry in 'zip_base' which can be reused for 'src',
+            files are considered unchanged when their size and CRC match
+            (checking is much faster than compressing again).
+            """
+            if zip_base_handle is None:
+                return None
+            try:
+                zinfo_base = zip_base_handle.getinfo(arcname)
+            except KeyError:
+                return None
+            if zinfo_base.compress_type != zip_compress_type(src, _compress_mode):
+                return None
+            if not zip_entry_matches_file(zinfo_base, src):
+                return None
+            return zinfo_base
 
         with zipfile.ZipFile(blendfile_dst.decode('utf-8'), 'w', _compress_mode) as zip_handle:
             for fn in path_temp_files:
@@ -506,12 +555,23 @@ def pack(
                 if (not os.path.exists(src)) or os.path.isdir(src):
                     yield report("  %s: %r\n" % (colorize("source missing", color='red'), src))
                 else:
-                    yield report("  %s: %r -> <archive>\n" % (colorize("copying", color='blue'), src))
-                    zip_handle.write(
-                            src.decode('utf-8'),
-                            arcname=os.path.relpath(dst, base_dir_dst).decode('utf-8'),
-                            compress_type=zipfile.ZIP_STORED if is_compressed_filetype(dst) else _compress_mode,
-                            )
+                    arcname = os.path.relpath(dst, base_dir_dst).decode('utf-8')
+                    zinfo_base = zip_base_entry(src, arcname)
+                    if zinfo_base is not None:
+                        yield report("  %s: %r -> <archive>\n" % (colorize("reusing", color='blue'), src))
+                        zip_copy_raw(zip_handle, zip_base_handle, zinfo_base)
+                    else:
+                        yield report("  %s: %r -> <archive>\n" % (colorize("copying", color='blue'), src))
+                        zip_handle.write(
+                                src.decode('utf-8'),
+                                arcname=arcname,
+                                compress_type=zip_compress_type(dst, _compress_mode),
+                                )
+                    del arcname, zinfo_base
+
+        if zip_base_handle is not None:
+            zip_base_handle.close()
+        del zip_base_handle, zip_base_entry
 
         zlib.Z_DEFAULT_COMPRESSION = _compress_level_orig
         del _compress_level_orig, _compress_mode
@@ -523,6 +583,204 @@ def pack(
         raise Exception("%s not a known mode" % mode)
 
 
+# written into the output of 'pack_multi'
+MANIFEST_NAME = ".bam_pack_manifest.json"
+
+
+def _pack_deps(args):
+    """
+    Scan the dependencies of a single blend file for 'pack_multi' (runs in a sub-process).
+
+    Returns ``(paths_remap, binary_edits)``:
+    paths_remap ``{dst_rel: src, ...}`` (str), binary_edits ``{src: [(ofs, data), ...], ...}`` (bytes).
+    """
+    import os
+    blendfile_src, blendfile_dst, base_dir_src, all_deps = args
+
+    paths_remap = {}
+    binary_edits = {}
+    for msg in pack(
+            blendfile_src, blendfile_dst, mode='NONE',
+            paths_remap=paths_remap,
+            all_deps=all_deps,
+            readonly=True,
+            binary_edits=binary_edits,
+            base_dir_src=base_dir_src,
+            ):
+        pass
+
+    # in 'NONE' mode, edits are stored by their location relative to 'base_dir_src'
+    binary_edits = {
+        os.path.normpath(os.path.join(base_dir_src, f)): edits
+        for f, edits in binary_edits.items()
+        }
+    return paths_remap, binary_edits
+
+
+def pack_multi(
+        blendfiles_src, path_dst, mode='FILE',
+        # defaults to the common directory of all blend files.
+        base_dir_src=None,
+        all_deps=False,
+        compress_level=-1,
+        # yield reports
+        report=None,
+        # number of processes used to scan dependencies (None for all CPU's).
+        jobs=None,
+        ):
+    """
+    Pack many blend files into a single directory (mode='FILE') or archive (mode='ZIP'),
+    files shared between blend files (libraries, images... etc) are only stored once.
+
+    The output mirrors the layout of ``base_dir_src``,
+    a manifest (``MANIFEST_NAME``) maps each blend file to its dependencies (paths relative to the output).
+    """
+    import os
+    import shutil
+    import concurrent.futures
+
+    from bam.utils.system import colorize
+
+    if report is None:
+        report = lambda msg: msg
+
+    blendfiles_src = [os.path.normpath(os.path.abspath(f)) for f in blendfiles_src]
+    path_dst = os.path.normpath(os.path.abspath(path_dst))
+    if base_dir_src is None:
+        base_dir_src = os.path.commonpath([os.path.dirname(f) for f in blendfiles_src])
+    base_dir_src = os.path.normpath(os.path.abspath(base_dir_src))
+
+    # {dst_rel: src}
+    paths_remap_all = {}
+    # {dst_rel: [(ofs, data), ...]}
+    binary_edits_all = {}
+    # {blendfile_rel: [dst_rel, ...]}
+    manifest = {}
+
+    # dependencies are only scanned (nothing is written), the destination is only used for relative paths.
+    args = [
+        (blendfile_src, os.path.join(path_dst, os.path.relpath(blendfile_src, base_dir_src)), base_dir_src, all_deps)
+        for blendfile_src in blendfiles_src
+        ]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for blendfile_src, (paths_remap, binary_edits) in zip(
+                blendfiles_src,
+                executor.map(_pack_deps, args),
+                ):
+            yield report("%s: %r...\n" % (colorize("\nscanning deps", color='bright_green'), blendfile_src))
+
+            # {src: dst_rel}
+            paths_remap_src = {}
+            for f_dst, f_src in paths_remap.items():
+                f_src_other = paths_remap_all.setdefault(f_dst, f_src)
+                if f_src_other != f_src:
+                    # only the first is stored, and listed in the manifest.
+                    yield report("  %s: %r (%r, %r)\n" % (
+                            colorize("conflicting paths", color='red'), f_dst, f_src_other, f_src))
+                paths_remap_src[os.path.normpath(f_src.encode('utf-8'))] = f_dst
+
+            for f_src, binary_edits_curr in binary_edits.items():
+                f_dst = paths_remap_src[f_src]
+                binary_edits_other = binary_edits_all.setdefault(f_dst, binary_edits_curr)
+                if binary_edits_other != binary_edits_curr:
+                    # variations may remap the same library differently, the first is used.
+                    yield report("  %s: %r\n" % (colorize("conflicting edits", color='red'), f_dst))
+
+            blendfile_rel = os.path.relpath(blendfile_src, base_dir_src).decode('utf-8')
+            manifest[blendfile_rel] = sorted(
+                    f_dst for f_dst, f_src in paths_remap.items()
+                    if f_dst != blendfile_rel and paths_remap_all[f_dst] == f_src)
+            del paths_remap, paths_remap_src, binary_edits
+
+    del args
+
+    yield report(("%s: %d files\n") %
+                 (colorize("\narchiving", color='bright_green'), len(paths_remap_all)))
+
+    def file_iter():
+        """
+        Yield (src, dst_rel, binary_edits) for each file to write.
+        """
+        for f_dst, f_src in sorted(paths_remap_all.items()):
+            yield f_src.encode('utf-8'), f_dst, binary_edits_all.get(f_dst)
+
+    def file_edit(src, dst, binary_edits):
+        shutil.copy(src, dst)
+        blendfile_path_walker.utils.binary_edits_apply(dst, sorted(binary_edits, key=lambda edit: edit[0]))
+
+    import json
+    manifest_data = json.dumps(manifest, indent=4, sort_keys=True)
+
+    # --------------------
+    # Handle File Copy/Zip
+
+    if mode == 'FILE':
+        for src, f_dst, binary_edits in file_iter():
+            dst = os.path.join(path_dst, f_dst.encode('utf-8'))
+
+            # in rare cases a filepath could point to a directory
+            if (not os.path.exists(src)) or os.path.isdir(src):
+                yield report("  %s: %r\n" % (colorize("source missing", color='red'), src))
+                continue
+
+            yield report("  %s: %r -> %r\n" % (colorize("copying", color='blue'), src, dst))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if binary_edits:
+                file_edit(src, dst, binary_edits)
+            else:
+                shutil.copy(src, dst)
+
+        with open(os.path.join(path_dst, MANIFEST_NAME.encode('utf-8')), 'w', encoding='utf-8') as f:
+            f.write(manifest_data)
+
+        yield report("  %s: %r\n" % (colorize("written", color='green'), path_dst))
+
+    elif mode == 'ZIP':
+        import zipfile
+        import tempfile
+
+        # not awesome!
+        import zlib
+        assert(compress_level in range(-1, 10))
+        _compress_level_orig = zlib.Z_DEFAULT_COMPRESSION
+        zlib.Z_DEFAULT_COMPRESSION = compress_level
+        _compress_mode = zipfile.ZIP_STORED if (compress_level == 0) else zipfile.ZIP_DEFLATED
+        from bam.utils.system import zip_compress_type
+
+        os.makedirs(os.path.dirname(path_dst), exist_ok=True)
+        with zipfile.ZipFile(path_dst.decode('utf-8'), 'w', _compress_mode) as zip_handle, \
+                tempfile.TemporaryDirectory() as temp_dir:
+            filepath_tmp = os.path.join(temp_dir.encode('utf-8'), b'edit.blend')
+
+            for src, f_dst, binary_edits in file_iter():
+                # in rare cases a filepath could point to a directory
+                if (not os.path.exists(src)) or os.path.isdir(src):
+                    yield report("  %s: %r\n" % (colorize("source missing", color='red'), src))
+                    continue
+
+                yield report("  %s: %r -> <archive>\n" % (colorize("copying", color='blue'), src))
+                if binary_edits:
+                    file_edit(src, filepath_tmp, binary_edits)
+                    zip_handle.write(filepath_tmp.decode('utf-8'), arcname=f_dst)
+                    os.remove(filepath_tmp)
+                else:
+                    zip_handle.write(
+                            src.decode('utf-8'),
+                            arcname=f_dst,
+                            compress_type=zip_compress_type(src, _compress_mode),
+                            )
+
+            zip_handle.writestr(MANIFEST_NAME, manifest_data)
+
+        zlib.Z_DEFAULT_COMPRESSION = _compress_level_orig
+        del _compress_level_orig, _compress_mode
+
+        yield report("  %s: %r\n" % (colorize("written", color='green'), path_dst))
+    else:
+        raise Exception("%s not a known mode" % mode)
+
+
 def create_argparse():
     import os
     import argparse
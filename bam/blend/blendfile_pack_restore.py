@@ -34,48 +34,58 @@ def blendfile_remap(
         deps_remap=None, deps_remap_cb=None,
         deps_remap_cb_userdata=None,
         ):
+    """
+    Remap paths, writing the result into ``blendpath_dst``.
+
+    When there are no paths to remap, nothing is written.
+
+    :return: True when the blend file was written.
+    """
     import os
 
-    def temp_remap_cb(filepath, level):
+    def remap_path(path_dst_final_b):
         """
-        Simply point to the output dir.
+        Return the original path or None.
         """
-        basename = os.path.basename(blendfile_src)
-        filepath_tmp = os.path.join(blendpath_dst, basename)
-
-        # ideally we could avoid copying _ALL_ blends
-        # TODO(cam)
-        import shutil
-        shutil.copy(filepath, filepath_tmp)
-
-        return filepath_tmp
-
-    for fp, (rootdir, fp_blend_basename) in blendfile_path_walker.FilePath.visit_from_blend(
-            blendfile_src,
-            readonly=False,
-            temp_remap_cb=temp_remap_cb,
-            recursive=False,
-            ):
-
-        # path_dst_final - current path in blend.
-        # path_src_orig - original path from JSON.
-
-        path_dst_final_b = fp.filepath
-
         # support 2 modes, callback or dictionary
         if deps_remap_cb is not None:
             path_src_orig = deps_remap_cb(path_dst_final_b, deps_remap_cb_userdata)
             if path_src_orig is not None:
-                fp.filepath = path_src_orig
                 if VERBOSE:
                     print("  Remapping:", path_dst_final_b, "->", path_src_orig)
+                return path_src_orig
         else:
             path_dst_final = path_dst_final_b.decode('utf-8')
             path_src_orig = deps_remap.get(path_dst_final)
             if path_src_orig is not None:
-                fp.filepath = path_src_orig.encode('utf-8')
                 if VERBOSE:
                     print("  Remapping:", path_dst_final, "->", path_src_orig)
+                return path_src_orig.encode('utf-8')
+        return None
+
+    # First scan the file (read-only), only copying when there are edits to make.
+    #
+    # path_dst_final - current path in blend.
+    # path_src_orig - original path from JSON.
+    binary_edits = []
+    for fp, (rootdir, fp_blend_basename) in blendfile_path_walker.FilePath.visit_from_blend(
+            blendfile_src,
+            readonly=True,
+            recursive=False,
+            ):
+        path_dst_final_b = fp.filepath
+        path_src_orig = remap_path(path_dst_final_b)
+        if path_src_orig is not None:
+            fp.filepath_assign_edits(path_src_orig, binary_edits)
+
+    if not binary_edits:
+        return False
+
+    import shutil
+    blendfile_dst = os.path.join(blendpath_dst, os.path.basename(blendfile_src))
+    shutil.copy(blendfile_src, blendfile_dst)
+    blendfile_path_walker.utils.binary_edits_apply(blendfile_dst, binary_edits)
+    return True
 
 
 def pack_restore(blendfile_dir_src, blendfile_dir_dst, pathmap):
@@ -92,7 +102,10 @@ def pack_restore(blendfile_dir_src, blendfile_dir_dst, pathmap):
                     filepath = os.path.join(dirpath, filename)
 
                     # main function call
-                    blendfile_remap(filepath, blendfile_dir_dst, remap)
+                    if not blendfile_remap(filepath, blendfile_dir_dst, remap):
+                        # nothing remapped, write the file as-is
+                        import shutil
+                        shutil.copy(filepath, os.path.join(blendfile_dir_dst, filename))
 
 
 def create_argparse():
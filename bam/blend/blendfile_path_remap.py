@@ -67,6 +67,179 @@ def _uuid_from_file(fn, block_size=1 << 20):
         return (hex(size)[2:] + sha1.hexdigest()).encode()
 
 
+def _uuid_partial_from_file(fn, block_size=1 << 16):
+    """
+    A cheap check to filter out files before calculating the full uuid,
+    only hashes the first and last blocks.
+    """
+    with open(fn, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(0, os.SEEK_SET)
+
+        import hashlib
+        sha1 = hashlib.new('sha1')
+        sha1.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(block_size, size - block_size), os.SEEK_SET)
+            sha1.update(f.read(block_size))
+        return (hex(size)[2:] + sha1.hexdigest()).encode()
+
+
+def _file_info(fn):
+    """
+    Return the values stored for each file by 'start'.
+    """
+    st = os.stat(fn)
+    return (
+        _uuid_from_file(fn),
+        _uuid_partial_from_file(fn),
+        st.st_size,
+        st.st_dev,
+        st.st_ino,
+        st.st_mtime_ns,
+        )
+
+
+def _blend_deps(blendfile_src):
+    """
+    Return [(f_abs, f_orig, exists), ...] for all files referenced by a blend file.
+    """
+    from bam.blend import blendfile_path_walker
+
+    deps = []
+    for fp, (rootdir, fp_blend_basename) in blendfile_path_walker.FilePath.visit_from_blend(
+            blendfile_src,
+            readonly=True,
+            recursive=False,
+            ):
+        f_abs = os.path.normpath(fp.filepath_absolute)
+        deps.append((f_abs, fp.filepath, os.path.exists(f_abs)))
+    return deps
+
+
+def _map_ordered(fn, items, use_processes=False, jobs=None):
+    """
+    Like ``map(fn, items)``, using a pool of workers.
+    """
+    import concurrent.futures
+
+    items = list(items)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if len(items) < 2 or jobs < 2:
+        return map(fn, items)
+
+    if use_processes:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+
+    def iter_results():
+        with executor:
+            yield from executor.map(fn, items)
+    return iter_results()
+
+
+# ----------------------------------------------------------------------------
+# Remap data
+#
+# Stored in an SQLite database, written as 'start' runs (so it can resume),
+# 'finish' looks up files as needed instead of loading everything.
+#
+# 'finish' journals the edits for each blend before writing them,
+# so an interrupted 'finish' can be run again.
+
+REMAP_DATA_VERSION = 1
+
+_REMAP_DATA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+-- all files we need to map (absolute paths),
+-- 'uuid' is NULL until the file has been read.
+CREATE TABLE IF NOT EXISTS files (
+    path BLOB PRIMARY KEY,
+    uuid BLOB,
+    uuid_partial BLOB,
+    size INTEGER,
+    dev INTEGER,
+    ino INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_uuid ON files (uuid);
+CREATE INDEX IF NOT EXISTS files_uuid_partial ON files (uuid_partial);
+CREATE INDEX IF NOT EXISTS files_inode ON files (dev, ino);
+-- blend files which have been read.
+CREATE TABLE IF NOT EXISTS blends (
+    path BLOB PRIMARY KEY
+);
+-- relative paths which don't exist,
+-- don't complain when they're missing on remap.
+CREATE TABLE IF NOT EXISTS lost (
+    blend BLOB,
+    path BLOB
+);
+CREATE INDEX IF NOT EXISTS lost_blend ON lost (blend);
+-- blend files read by 'finish' (their new & original path),
+-- 'done' once the edits have been written.
+CREATE TABLE IF NOT EXISTS remap (
+    dst BLOB PRIMARY KEY,
+    src BLOB,
+    done INTEGER
+);
+-- edits to write into each blend file.
+CREATE TABLE IF NOT EXISTS edits (
+    dst BLOB,
+    ofs INTEGER,
+    data BLOB
+);
+CREATE INDEX IF NOT EXISTS edits_dst ON edits (dst);
+"""
+
+
+def _remap_data_open(filepath_remap, create=False):
+    import sqlite3
+
+    if not (create or os.path.exists(filepath_remap)):
+        raise ValueError("%r not found" % filepath_remap)
+
+    db = sqlite3.connect(filepath_remap)
+    try:
+        if create:
+            db.execute("PRAGMA journal_mode = WAL")
+            db.executescript(_REMAP_DATA_SCHEMA)
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('version', ?)", (REMAP_DATA_VERSION,))
+            db.commit()
+        version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        version = None
+    if version is None or version[0] != REMAP_DATA_VERSION:
+        db.close()
+        raise ValueError("%r is not a remap file (or from a different version)" % filepath_remap)
+    db.execute("PRAGMA synchronous = NORMAL")
+    return db
+
+
+def _remap_data_meta(db, key, default=None):
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return default if row is None else row[0]
+
+
+def status(filepath_remap):
+    """
+    Return the state of a remap: "complete" once 'start' is done, otherwise "partial".
+
+    Raises ValueError when the file isn't a valid remap file.
+    """
+    db = _remap_data_open(filepath_remap)
+    try:
+        return "complete" if _remap_data_meta(db, "complete") else "partial"
+    finally:
+        db.close()
+
+
 def _iter_files(paths, check_ext=None):
     # note, sorting isn't needed
     # just gives predictable output
@@ -87,11 +260,15 @@ def _iter_files(paths, check_ext=None):
 # Public Functions
 
 def start(
-        paths,
+        paths, filepath_remap,
         is_quiet=False,
         dry_run=False,
         use_json=False,
         ):
+    """
+    Store information about the files in 'paths' in 'filepath_remap',
+    when the file exists (from an interrupted 'start'), continue where it stopped.
+    """
 
     if use_json:
         warn = _warn__json
@@ -103,89 +280,90 @@ def start(
     if use_json:
         print("[")
 
-    # {(sha1, length): "filepath"}
-    remap_uuid = {}
-
-    # relative paths which don't exist,
-    # don't complain when they're missing on remap.
-    # {f_src: [relative path deps, ...]}
-    remap_lost = {}
-
-    # all files we need to map
-    # absolute paths
-    files_to_map = set()
-
-    # TODO, validate paths aren't nested! ["/foo", "/foo/bar"]
-    # it will cause problems touching files twice!
-
-    # ------------------------------------------------------------------------
-    # First walk over all blends
-    from bam.blend import blendfile_path_walker
-
-    for blendfile_src in _iter_files(paths, check_ext=_is_blend):
-        if not is_quiet:
-            info("blend read: %r" % blendfile_src)
-
-        remap_lost[blendfile_src] = remap_lost_blendfile_src = set()
-
-        for fp, (rootdir, fp_blend_basename) in blendfile_path_walker.FilePath.visit_from_blend(
-                blendfile_src,
-                readonly=True,
-                recursive=False,
+    db = _remap_data_open(filepath_remap, create=True)
+    try:
+        # commit after writing this many files
+        COMMIT_STEP = 256
+
+        # TODO, validate paths aren't nested! ["/foo", "/foo/bar"]
+        # it will cause problems touching files twice!
+
+        # ------------------------------------------------------------------------
+        # First walk over all blends
+        #
+        # blend files are read in parallel (separate processes),
+        # reports are in the same order as reading them one at a time.
+        blendfiles_done = {row[0] for row in db.execute("SELECT path FROM blends")}
+        blendfiles_src = [f for f in _iter_files(paths, check_ext=_is_blend) if f not in blendfiles_done]
+        if blendfiles_done and not is_quiet:
+            info("resume: %r" % filepath_remap)
+        del blendfiles_done
+
+        for blendfile_src, deps in zip(
+                blendfiles_src,
+                _map_ordered(_blend_deps, blendfiles_src, use_processes=True),
                 ):
-            # TODO. warn when referencing files outside 'paths'
-
-            # so we can update the reference
-            f_abs = fp.filepath_absolute
-            f_abs = os.path.normpath(f_abs)
-            if os.path.exists(f_abs):
-                files_to_map.add(f_abs)
-            else:
-                if not is_quiet:
-                    warn("file %r not found!" % f_abs)
-
-                # don't complain about this file being missing on remap
-                remap_lost_blendfile_src.add(fp.filepath)
-
-        # so we can know where its moved to
-        files_to_map.add(blendfile_src)
-    del blendfile_path_walker
-
-    # ------------------------------------------------------------------------
-    # Store UUID
-    #
-    # note, sorting is only to give predictable warnings/behavior
-    for f in sorted(files_to_map):
-        f_uuid = _uuid_from_file(f)
-
-        f_match = remap_uuid.get(f_uuid)
-        if f_match is not None:
             if not is_quiet:
-                warn("duplicate file found! (%r, %r)" % (f_match, f))
+                info("blend read: %r" % blendfile_src)
+
+            with db:
+                for f_abs, f_orig, exists in deps:
+                    # TODO. warn when referencing files outside 'paths'
+
+                    # so we can update the reference
+                    if exists:
+                        db.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (f_abs,))
+                    else:
+                        if not is_quiet:
+                            warn("file %r not found!" % f_abs)
+
+                        # don't complain about this file being missing on remap
+                        db.execute("INSERT INTO lost VALUES (?, ?)", (blendfile_src, f_orig))
+
+                # so we can know where its moved to
+                db.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (blendfile_src,))
+                db.execute("INSERT INTO blends VALUES (?)", (blendfile_src,))
+        del blendfiles_src
+
+        # ------------------------------------------------------------------------
+        # Store UUID
+        #
+        # note, sorting is only to give predictable warnings/behavior
+        files_to_map = [row[0] for row in db.execute("SELECT path FROM files WHERE uuid IS NULL ORDER BY path")]
+        for i, (f, f_info) in enumerate(zip(files_to_map, _map_ordered(_file_info, files_to_map))):
+            f_uuid = f_info[0]
+            f_match = db.execute(
+                    "SELECT path FROM files WHERE uuid = ? ORDER BY path DESC LIMIT 1", (f_uuid,)).fetchone()
+            if f_match is not None:
+                if not is_quiet:
+                    warn("duplicate file found! (%r, %r)" % (f_match[0], f))
 
-        remap_uuid[f_uuid] = f
+            db.execute(
+                    "UPDATE files SET uuid = ?, uuid_partial = ?, size = ?, dev = ?, ino = ?, mtime_ns = ? "
+                    "WHERE path = ?", f_info + (f,))
+            if (i % COMMIT_STEP) == COMMIT_STEP - 1:
+                db.commit()
+        del files_to_map
 
-    # now find all deps
-    remap_data_args = (
-            remap_uuid,
-            remap_lost,
-            )
+        with db:
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('complete', 1)")
+        is_empty = db.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+    finally:
+        db.close()
 
     if use_json:
-        if not remap_uuid:
+        if is_empty:
             print("\"nothing to remap!\"")
         else:
             print("\"complete\"")
         print("]")
     else:
-        if not remap_uuid:
+        if is_empty:
             print("Nothing to remap!")
 
-    return remap_data_args
-
 
 def finish(
-        paths, remap_data_args,
+        paths, filepath_remap,
         is_quiet=False,
         force_relative=False,
         dry_run=False,
@@ -202,79 +380,152 @@ def finish(
     if use_json:
         print("[")
 
-    (remap_uuid,
-     remap_lost,
-     ) = remap_data_args
-
-    remap_src_to_dst = {}
-    remap_dst_to_src = {}
-
-    for f_dst in _iter_files(paths):
-        f_uuid = _uuid_from_file(f_dst)
-        f_src = remap_uuid.get(f_uuid)
-        if f_src is not None:
-            remap_src_to_dst[f_src] = f_dst
-            remap_dst_to_src[f_dst] = f_src
-
-    # now the fun begins, remap _all_ paths
-    from bam.blend import blendfile_path_walker
-
-    for blendfile_dst in _iter_files(paths, check_ext=_is_blend):
-        blendfile_src = remap_dst_to_src.get(blendfile_dst)
-        if blendfile_src is None:
-            if not is_quiet:
-                warn("new blendfile added since beginning 'remap': %r" % blendfile_dst)
-            continue
-
-        # not essential, just so we can give more meaningful errors
-        remap_lost_blendfile_src = remap_lost[blendfile_src]
-
-        if not is_quiet:
-            info("blend write: %r -> %r" % (blendfile_src, blendfile_dst))
-
-        blendfile_src_basedir = os.path.dirname(blendfile_src)
-        blendfile_dst_basedir = os.path.dirname(blendfile_dst)
-        for fp, (rootdir, fp_blend_basename) in blendfile_path_walker.FilePath.visit_from_blend(
-                blendfile_dst,
-                readonly=False,
-                recursive=False,
-                ):
-            # TODO. warn when referencing files outside 'paths'
-
-            # so we can update the reference
-            f_src_orig = fp.filepath
-
-            if f_src_orig in remap_lost_blendfile_src:
-                # this file never existed, so we can't remap it
+    db = _remap_data_open(filepath_remap)
+    try:
+        if not _remap_data_meta(db, "complete"):
+            raise ValueError("%r is incomplete, run 'start' again" % filepath_remap)
+
+        remap_src_to_dst = {}
+        remap_dst_to_src = {}
+
+        # blends read by an interrupted 'finish',
+        # these may have been written to already (so they can't be found by their uuid).
+        for blendfile_dst, blendfile_src in db.execute("SELECT dst, src FROM remap"):
+            remap_src_to_dst[blendfile_src] = blendfile_dst
+            remap_dst_to_src[blendfile_dst] = blendfile_src
+        blendfiles_journal = set(remap_dst_to_src)
+        if blendfiles_journal and not is_quiet:
+            info("resume: %r" % filepath_remap)
+
+        # first match files which were moved (same inode & unmodified),
+        # only hash the remaining files which may match.
+        remap_sizes = {row[0] for row in db.execute("SELECT DISTINCT size FROM files")}
+        files_dst = []
+        for f_dst in _iter_files(paths):
+            if f_dst in blendfiles_journal:
+                continue
+            st = os.stat(f_dst)
+            f_src_item = db.execute(
+                    "SELECT path FROM files WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                    (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)).fetchone()
+            if f_src_item is not None:
+                f_src = f_src_item[0]
+                remap_src_to_dst[f_src] = f_dst
+                remap_dst_to_src[f_dst] = f_src
+            elif st.st_size in remap_sizes:
+                files_dst.append(f_dst)
+        del remap_sizes
+
+        # copies of files we found by their inode don't replace them.
+        remap_src_found = set(remap_src_to_dst)
+
+        # files with the same size, check the partial uuid before reading the whole file.
+        files_dst = [
+                f_dst for f_dst, f_uuid_partial in zip(
+                        files_dst, _map_ordered(_uuid_partial_from_file, files_dst))
+                if db.execute("SELECT 1 FROM files WHERE uuid_partial = ? LIMIT 1", (f_uuid_partial,)).fetchone()
+                ]
+
+        for f_dst, f_uuid in zip(files_dst, _map_ordered(_uuid_from_file, files_dst)):
+            # with duplicates, the last file (sorted by path) is used.
+            f_src = db.execute(
+                    "SELECT path FROM files WHERE uuid = ? ORDER BY path DESC LIMIT 1", (f_uuid,)).fetchone()
+            if f_src is not None:
+                f_src = f_src[0]
+                if f_src not in remap_src_found:
+                    remap_src_to_dst[f_src] = f_dst
+                remap_dst_to_src[f_dst] = f_src
+        del files_dst, remap_src_found
+
+        # now the fun begins, remap _all_ paths
+        #
+        # first collect & journal the edits for each blend,
+        # the blends are only written once they have all been read.
+        from bam.blend import blendfile_path_walker
+
+        for blendfile_dst in _iter_files(paths, check_ext=_is_blend):
+            if blendfile_dst in blendfiles_journal:
                 continue
 
-            is_relative = f_src_orig.startswith(b'//')
-            if is_relative:
-                f_src_abs = fp.filepath_absolute_resolve(basedir=blendfile_src_basedir)
-            else:
-                f_src_abs = f_src_orig
-
-            f_src_abs = os.path.normpath(f_src_abs)
-            f_dst_abs = remap_src_to_dst.get(f_src_abs)
-
-            if f_dst_abs is None:
+            blendfile_src = remap_dst_to_src.get(blendfile_dst)
+            if blendfile_src is None:
                 if not is_quiet:
-                    warn("file %r not found in map!" % f_src_abs)
+                    warn("new blendfile added since beginning 'remap': %r" % blendfile_dst)
                 continue
 
-            # now remap!
-            if is_relative or force_relative:
-                f_dst_final = b'//' + os.path.relpath(f_dst_abs, blendfile_dst_basedir)
-            else:
-                f_dst_final = f_dst_abs
+            # not essential, just so we can give more meaningful errors
+            remap_lost_blendfile_src = {
+                    row[0] for row in db.execute("SELECT path FROM lost WHERE blend = ?", (blendfile_src,))}
 
-            if f_dst_final != f_src_orig:
-                if not dry_run:
-                    fp.filepath = f_dst_final
-                if not is_quiet:
-                    info("remap %r -> %r" % (f_src_abs, f_dst_abs))
-
-    del blendfile_path_walker
+            if not is_quiet:
+                info("blend write: %r -> %r" % (blendfile_src, blendfile_dst))
+
+            blendfile_src_basedir = os.path.dirname(blendfile_src)
+            blendfile_dst_basedir = os.path.dirname(blendfile_dst)
+            binary_edits = []
+            for fp, (rootdir, fp_blend_basename) in blendfile_path_walker.FilePath.visit_from_blend(
+                    blendfile_dst,
+                    readonly=True,
+                    recursive=False,
+                    ):
+                # TODO. warn when referencing files outside 'paths'
+
+                # so we can update the reference
+                f_src_orig = fp.filepath
+
+                if f_src_orig in remap_lost_blendfile_src:
+                    # this file never existed, so we can't remap it
+                    continue
+
+                is_relative = f_src_orig.startswith(b'//')
+                if is_relative:
+                    f_src_abs = fp.filepath_absolute_resolve(basedir=blendfile_src_basedir)
+                else:
+                    f_src_abs = f_src_orig
+
+                f_src_abs = os.path.normpath(f_src_abs)
+                f_dst_abs = remap_src_to_dst.get(f_src_abs)
+
+                if f_dst_abs is None:
+                    if not is_quiet:
+                        warn("file %r not found in map!" % f_src_abs)
+                    continue
+
+                # now remap!
+                if is_relative or force_relative:
+                    f_dst_final = b'//' + os.path.relpath(f_dst_abs, blendfile_dst_basedir)
+                else:
+                    f_dst_final = f_dst_abs
+
+                if f_dst_final != f_src_orig:
+                    fp.filepath_assign_edits(f_dst_final, binary_edits)
+                    if not is_quiet:
+                        info("remap %r -> %r" % (f_src_abs, f_dst_abs))
+
+            if not dry_run:
+                with db:
+                    db.execute("INSERT INTO remap VALUES (?, ?, ?)", (blendfile_dst, blendfile_src, not binary_edits))
+                    db.executemany(
+                            "INSERT INTO edits VALUES (?, ?, ?)",
+                            ((blendfile_dst, ofs, data) for ofs, data in binary_edits))
+            del binary_edits
+
+        # write the edits, one blend at a time
+        if not dry_run:
+            blendfiles_pending = [
+                    row[0] for row in db.execute("SELECT dst FROM remap WHERE done = 0 ORDER BY dst")]
+            for blendfile_dst in blendfiles_pending:
+                blendfile_path_walker.utils.binary_edits_apply(
+                        blendfile_dst,
+                        db.execute("SELECT ofs, data FROM edits WHERE dst = ? ORDER BY ofs, rowid", (blendfile_dst,)))
+                with db:
+                    db.execute("UPDATE remap SET done = 1 WHERE dst = ?", (blendfile_dst,))
+                    db.execute("DELETE FROM edits WHERE dst = ?", (blendfile_dst,))
+            del blendfiles_pending
+
+        del blendfile_path_walker
+    finally:
+        db.close()
 
     if use_json:
         print("\"complete\"\n]")
@@ -201,7 +201,7 @@ class FPElem_sequence_image_seq(FPElem_sequence_single):
         block, path, sub_block, sub_path = self.userdata
 
         array = block.get_pointer(b'stripdata')
-        files = [array.get(b'name', use_str=False, base_index=i) for i in range(array.count)]
+        files = array.get_array(b'name', use_str=False)
         return files
 
 
@@ -589,16 +589,23 @@ class bf_utils:
 
     def iter_array(block, length=-1):
         assert(block.code == b'DATA')
-        from bam.blend import blendfile
         import os
+        import struct
         handle = block.file.handle
         header = block.file.header
 
-        for i in range(length):
-            block.file.handle.seek(block.file_offset + (header.pointer_size * i), os.SEEK_SET)
-            offset = blendfile.DNA_IO.read_pointer(handle, header)
-            sub_block = block.file.find_block_from_offset(offset)
-            yield sub_block
+        if length <= 0:
+            return
+
+        # read all pointers at once
+        handle.seek(block.file_offset, os.SEEK_SET)
+        data = handle.read(header.pointer_size * length)
+        data = data[:len(data) - (len(data) % header.pointer_size)]
+        st = header.endian_str + (b'I' if header.pointer_size == 4 else b'Q')
+
+        block_from_offset = block.file.block_from_offset
+        for offset, in struct.iter_unpack(st, data):
+            yield block_from_offset.get(offset)
 
 
 # -----------------------------------------------------------------------------
@@ -816,6 +823,66 @@ class ExpandID:
 # Packing Utility
 
 
+class DirectoryIndex:
+    """
+    Lists each directory once, grouping files which may be part of a sequence
+    by their ``(prefix, ext)``, eg: ``render_0001.png`` -> ``(render_, .png)``.
+
+    This avoids reading & filtering the same (possibly huge) directory
+    for every sequence which references it.
+    """
+    __slots__ = (
+        # {basedir: {(prefix, ext): [filename, ...], ...}, ...}
+        "_dirs",
+        )
+
+    def __init__(self):
+        self._dirs = {}
+
+    @staticmethod
+    def _split(filename):
+        """
+        Return the ``(prefix, ext)`` of a filename or None when it isn't part of a sequence.
+        """
+        from string import digits
+        if isinstance(filename, bytes):
+            digits = digits.encode()
+
+        filename_noext, ext = os.path.splitext(filename)
+        filename_nodigits = filename_noext.rstrip(digits)
+        if len(filename_nodigits) == len(filename_noext):
+            return None
+        return filename_nodigits, ext
+
+    def _index(self, basedir):
+        frames = self._dirs.get(basedir)
+        if frames is None:
+            frames = self._dirs[basedir] = {}
+            try:
+                files = os.listdir(basedir)
+            except OSError:
+                files = ()
+            for f in files:
+                key = self._split(f)
+                if key is not None:
+                    frames.setdefault(key, []).append(f)
+        return frames
+
+    def find_sequence_paths(self, filepath, use_fullpath=True):
+        # supports str, byte paths
+        basedir, filename = os.path.split(filepath)
+
+        key = self._split(filename)
+        if key is None:
+            # input isn't from a sequence
+            return []
+
+        files = self._index(basedir).get(key, [])
+        if use_fullpath:
+            return [os.path.join(basedir, f) for f in files]
+        return files[:]
+
+
 class utils:
     # fake module
     __slots__ = ()
@@ -854,33 +921,69 @@ class utils:
         else:
             return split2
 
-    def find_sequence_paths(filepath, use_fullpath=True):
-        # supports str, byte paths
-        basedir, filename = os.path.split(filepath)
-        if not os.path.exists(basedir):
-            return []
-
-        filename_noext, ext = os.path.splitext(filename)
-
-        from string import digits
-        if isinstance(filepath, bytes):
-            digits = digits.encode()
-        filename_nodigits = filename_noext.rstrip(digits)
-
-        if len(filename_nodigits) == len(filename_noext):
-            # input isn't from a sequence
-            return []
+    @staticmethod
+    def binary_edits_coalesce(binary_edits):
+        """
+        Merge ``(offset, data)`` edits (sorted by offset) which touch or overlap,
+        so each range is written once, later edits take precedence.
+        """
+        ofs_start = None
+        buf = bytearray()
+        for ofs, data in binary_edits:
+            if ofs_start is not None and ofs <= ofs_start + len(buf):
+                i = ofs - ofs_start
+                buf[i:i + len(data)] = data
+            else:
+                if ofs_start is not None:
+                    yield ofs_start, bytes(buf)
+                ofs_start = ofs
+                buf = bytearray(data)
+        if ofs_start is not None:
+            yield ofs_start, bytes(buf)
 
-        files = os.listdir(basedir)
-        files[:] = [
-            f for f in files
-            if f.startswith(filename_nodigits) and
-            f.endswith(ext) and
-            f[len(filename_nodigits):-len(ext) if ext else -1].isdigit()
-            ]
-        if use_fullpath:
-            files[:] = [
-                os.path.join(basedir, f) for f in files
-                ]
+    @staticmethod
+    def binary_edits_apply(filepath, binary_edits):
+        """
+        Write ``(offset, data)`` edits (from ``FilePath.filepath_assign_edits``) into a blend file,
+        sorted by offset.
 
-        return files
+        Writing the same edits again is harmless, so an interrupted write can simply be repeated.
+        """
+        with open(filepath, 'rb+') as fh_blend:
+            is_compressed = (fh_blend.read(2) == b'\x1f\x8b')
+            if not is_compressed:
+                for ofs, data in utils.binary_edits_coalesce(binary_edits):
+                    fh_blend.seek(ofs)
+                    fh_blend.write(data)
+                fh_blend.flush()
+                os.fsync(fh_blend.fileno())
+                return
+
+        # offsets are into the uncompressed file,
+        # write a new compressed file and replace the original (so it's never left half written).
+        import gzip
+        import shutil
+        import tempfile
+
+        filepath_tmp = filepath + (b'@bam' if isinstance(filepath, bytes) else '@bam')
+        with tempfile.TemporaryFile() as fh_data:
+            with gzip.open(filepath, 'rb') as fh_src:
+                shutil.copyfileobj(fh_src, fh_data)
+            for ofs, data in utils.binary_edits_coalesce(binary_edits):
+                fh_data.seek(ofs)
+                fh_data.write(data)
+            fh_data.seek(0)
+
+            with open(filepath_tmp, 'wb') as fh_dst:
+                with gzip.GzipFile(fileobj=fh_dst, mode='wb') as fh_dst_gzip:
+                    shutil.copyfileobj(fh_data, fh_dst_gzip)
+                fh_dst.flush()
+                os.fsync(fh_dst.fileno())
+        os.replace(filepath_tmp, filepath)
+
+    def find_sequence_paths(filepath, use_fullpath=True, dir_index=None):
+        # supports str, byte paths
+        # pass in a 'DirectoryIndex' when looking up many sequences.
+        if dir_index is None:
+            dir_index = DirectoryIndex()
+        return dir_index.find_sequence_paths(filepath, use_fullpath=use_fullpath)
@@ -235,6 +235,93 @@ class bam_session:
         result = "%s/%s" % (cfg['url'], req_path)
         return result
 
+    @staticmethod
+    def request_upload(cfg, filepath, chunk_size=1 << 22, retries=8):
+        """
+        Upload a file in chunks (each with a checksum),
+        resuming from the servers offset when a request fails.
+
+        Returns the upload-id, to reference the upload in later requests.
+        """
+        import requests
+        import hashlib
+        import time
+        from bam.utils.system import uuid_from_file
+
+        upload_id = uuid_from_file(filepath)
+        size = os.path.getsize(filepath)
+
+        def upload_offset():
+            r = requests.get(
+                    bam_session.request_url("file"),
+                    params={
+                        "command": "commit_upload_status",
+                        "arguments": json.dumps({"upload_id": upload_id}),
+                        },
+                    auth=(cfg["user"], cfg["password"]),
+                    )
+            return r.json()["offset"]
+
+        with open(filepath, 'rb') as fh:
+            offset = None
+            # set when the server has more data than we do (a corrupt upload),
+            # the server removes its data when receiving the first chunk.
+            truncate = False
+            retry_delay = 0.5
+            while offset != size:
+                try:
+                    if offset is None:
+                        # resume from what the server already has
+                        offset = upload_offset()
+                        if offset == size:
+                            break
+                        if offset > size:
+                            offset = 0
+                            truncate = True
+
+                    fh.seek(offset)
+                    data = fh.read(chunk_size)
+                    r = requests.put(
+                            bam_session.request_url("file"),
+                            params={
+                                "command": "commit_upload",
+                                "arguments": json.dumps({
+                                    "upload_id": upload_id,
+                                    "offset": offset,
+                                    "checksum": hashlib.sha1(data).hexdigest(),
+                                    "truncate": truncate,
+                                    }),
+                                },
+                            auth=(cfg["user"], cfg["password"]),
+                            files={"file": data},
+                            )
+                    # the server may reject the chunk (bad checksum or offset),
+                    # either way it gives us the offset to continue from.
+                    offset_next = r.json()["offset"]
+                    if offset_next > size:
+                        # resuming sets 'truncate'
+                        raise ValueError("upload larger than %d at the server" % size)
+                    if offset_next <= offset:
+                        raise ValueError("chunk at offset %d rejected" % offset)
+                    truncate = False
+                    offset = offset_next
+                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                    if not retries:
+                        fatal("upload failed (%s)" % str(e))
+                    retries -= 1
+                    offset = None
+                    # back off, so a server that's restarting (or overloaded) has time to recover
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2.0, 30.0)
+                else:
+                    retry_delay = 0.5
+
+                sys.stdout.write("\rupload: [%03d%%]" % ((100 * (offset or 0)) // max(size, 1)))
+                sys.stdout.flush()
+        sys.stdout.write("\n")
+
+        return upload_id
+
     @staticmethod
     def status(session_rootdir,
                paths_uuid_update=None):
@@ -384,6 +471,36 @@ class bam_session:
             del write_json_to_file
             del paths_uuid
 
+    @staticmethod
+    def blendfile_remap_to_project(
+            blendfile_src,  # bytes
+            blendfile_dst_dir,  # bytes
+            proj_base_b,  # bytes
+            ):
+        """
+        Before committing a blend file, we need to remap paths to the project
+        (from their session relative locations).
+
+        Note that this may run in a sub-process.
+
+        Returns True when the blend file was written (paths were remapped).
+        """
+
+        def remap_cb(f, data):
+            # check for the absolute path hint
+            if f.startswith(b'//_'):
+                proj_base_b = data
+                return b'//' + os.path.relpath(f[3:], proj_base_b)
+            return None
+
+        from bam.blend import blendfile_pack_restore
+        return blendfile_pack_restore.blendfile_remap(
+                blendfile_src,
+                blendfile_dst_dir,
+                deps_remap_cb=remap_cb,
+                deps_remap_cb_userdata=proj_base_b,
+                )
+
     @staticmethod
     def binary_edits_update_single(
             blendfile_abs,
@@ -494,6 +611,9 @@ class bam_commands:
         # ---------
         # constants
         CHUNK_SIZE = 1024
+        CHUNK_SIZE_COPY = 1 << 20
+        # only request deltas for cached files at least this size
+        DELTA_SIZE_MIN = 1 << 20
 
         cfg = bam_config.load(abort=True)
 
@@ -563,7 +683,7 @@ class bam_commands:
                     break
 
             tot_size = 0
-            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE_COPY):
                 if chunk:  # filter out keep-alive new chunks
                     tot_size += len(chunk)
                     f.write(chunk)
@@ -595,6 +715,9 @@ class bam_commands:
         # which we don't have in cache,
         # note that its possible we have all in cache and don't need to make a second request.
         files = []
+        # {f_dst: signature, ...} for files we have an outdated copy of,
+        # so the server only needs to send the changes.
+        signatures = {}
         with open(os.path.join(session_rootdir, ".bam_paths_remap.json")) as fp:
             from bam.utils.system import uuid_from_file
             paths_remap = json.load(fp)
@@ -616,6 +739,12 @@ class bam_commands:
                         if uuid == uuid_exists:
                             continue
 
+                        if os.path.getsize(f_dst_abs) >= DELTA_SIZE_MIN:
+                            from bam.blend import blendfile_delta
+                            if blendfile_delta.is_delta_supported(f_dst_abs):
+                                signatures[f_dst] = blendfile_delta.signature_from_file(f_dst_abs)
+                            del blendfile_delta
+
                 files.append(f_dst)
 
             del uuid_from_file
@@ -625,15 +754,28 @@ class bam_commands:
                 "command": "checkout_download",
                 "arguments": json.dumps({
                     "files": files,
+                    "signatures": signatures,
+                    # we handle uncompressed payloads (ID_PAYLOAD_RAW*)
+                    "payload_raw": True,
                     }),
                 }
             import requests
-            r = requests.get(
-                    bam_session.request_url("file"),
-                    params=payload,
-                    auth=(cfg['user'], cfg['password']),
-                    stream=True,
-                    )
+            if signatures:
+                # signatures may be too large for the URL
+                r = requests.post(
+                        bam_session.request_url("file"),
+                        params={"command": payload["command"]},
+                        data={"arguments": payload["arguments"]},
+                        auth=(cfg['user'], cfg['password']),
+                        stream=True,
+                        )
+            else:
+                r = requests.get(
+                        bam_session.request_url("file"),
+                        params=payload,
+                        auth=(cfg['user'], cfg['password']),
+                        stream=True,
+                        )
 
             if r.status_code not in {200, }:
                 # TODO(cam), make into reusable function?
@@ -656,6 +798,10 @@ class bam_commands:
             ID_PAYLOAD_APPEND = 3
             ID_PAYLOAD_EMPTY = 4
             ID_DONE = 5
+            ID_PAYLOAD_DELTA = 6
+            ID_PAYLOAD_COPY = 7
+            ID_PAYLOAD_RAW = 8
+            ID_PAYLOAD_RAW_APPEND = 9
             head = r.raw.read(4)
             if head != b'BAM\0':
                 fatal("bad header from server")
@@ -719,9 +865,80 @@ class bam_commands:
                             is_header_read = False
                             break
 
+                elif msg_type == ID_PAYLOAD_RAW:
+                    # uncompressed (media which is already compressed)
+                    f_rel = files[file_index]
+                    f_abs = os.path.join(cachedir, files[file_index])
+                    file_index += 1
+
+                    sys.stdout.write("file: %r" % f_rel)
+                    sys.stdout.flush()
+
+                    os.makedirs(os.path.dirname(f_abs), exist_ok=True)
+
+                    tot_size = 0
+                    with open(f_abs, "wb") as f:
+                        while True:
+                            for chunk in iter_content_size(r, msg_size, chunk_size=CHUNK_SIZE_COPY):
+                                f.write(chunk)
+                                tot_size += len(chunk)
+                            sys.stdout.write("\rdownload: %d bytes" % tot_size)
+                            sys.stdout.flush()
+
+                            msg_type, msg_size = struct.unpack("<II", r.raw.read(8))
+                            if msg_type == ID_PAYLOAD_RAW_APPEND:
+                                continue
+
+                            # don't re-read the header next iteration
+                            is_header_read = False
+                            break
+
+                elif msg_type == ID_PAYLOAD_DELTA:
+                    # rebuild the file from our cached copy,
+                    # with only the changes sent from the server
+                    f_rel = files[file_index]
+                    f_abs = os.path.join(cachedir, files[file_index])
+                    f_abs_tmp = f_abs + "@"
+                    file_index += 1
+
+                    sys.stdout.write("file: %r (delta)" % f_rel)
+                    sys.stdout.flush()
+
+                    import lzma
+                    tot_size = 0
+                    with open(f_abs, "rb") as f_src, open(f_abs_tmp, "wb") as f:
+                        while True:
+                            msg_type, msg_size = struct.unpack("<II", r.raw.read(8))
+                            if msg_type == ID_PAYLOAD_APPEND:
+                                f.write(lzma.decompress(b''.join(iter_content_size(r, msg_size))))
+                                tot_size += msg_size
+                            elif msg_type == ID_PAYLOAD_RAW_APPEND:
+                                for chunk in iter_content_size(r, msg_size, chunk_size=CHUNK_SIZE_COPY):
+                                    f.write(chunk)
+                                tot_size += msg_size
+                            elif msg_type == ID_PAYLOAD_COPY:
+                                copy_ofs, copy_size = struct.unpack("<QQ", r.raw.read(msg_size))
+                                f_src.seek(copy_ofs)
+                                while copy_size:
+                                    data = f_src.read(min(copy_size, CHUNK_SIZE_COPY))
+                                    assert(data)
+                                    f.write(data)
+                                    copy_size -= len(data)
+                                del data
+                            else:
+                                # otherwise continue the outer loop, without re-reading the header
+                                is_header_read = False
+                                break
+
+                            sys.stdout.write("\rdownload: %d bytes" % tot_size)
+                            sys.stdout.flush()
+
+                    os.replace(f_abs_tmp, f_abs)
+                    del lzma
+
                 elif msg_type == ID_DONE:
                     break
-                elif msg_type == ID_PAYLOAD_APPEND:
+                elif msg_type in {ID_PAYLOAD_APPEND, ID_PAYLOAD_RAW_APPEND}:
                     # Should only handle in a read-loop above
                     raise Exception("Invalid state for message-type %d" % msg_type)
                 else:
@@ -995,42 +1212,44 @@ class bam_commands:
 
             return f_rel_in_proj
 
-        def remap_cb(f, data):
-            # check for the absolute path hint
-            if f.startswith(b'//_'):
-                proj_base_b = data
-                return b'//' + os.path.relpath(f[3:], proj_base_b)
-            return None
+        # remap blend files, each file is independent so run them in parallel
+        remap_jobs = []
+        for paths_dict in (paths_modified, paths_add):
+            for f_rel, f_abs in paths_dict.items():
+                if f_abs.endswith(".blend"):
+                    f_abs_remap = os.path.join(basedir_temp, f_rel)
+                    dir_remap = os.path.dirname(f_abs_remap)
+                    os.makedirs(dir_remap, exist_ok=True)
 
-        def remap_file(f_rel, f_abs):
-            f_abs_remap = os.path.join(basedir_temp, f_rel)
-            dir_remap = os.path.dirname(f_abs_remap)
-            os.makedirs(dir_remap, exist_ok=True)
-
-            # final location in the project
-            f_rel_in_proj = remap_filepath(f_rel)
-            proj_base_b = os.path.dirname(f_rel_in_proj).encode("utf-8")
-
-            from bam.blend import blendfile_pack_restore
-            blendfile_pack_restore.blendfile_remap(
-                    f_abs.encode('utf-8'),
-                    dir_remap.encode('utf-8'),
-                    deps_remap_cb=remap_cb,
-                    deps_remap_cb_userdata=proj_base_b,
-                    )
-            return f_abs_remap
+                    # final location in the project
+                    f_rel_in_proj = remap_filepath(f_rel)
+                    proj_base_b = os.path.dirname(f_rel_in_proj).encode("utf-8")
 
-        for f_rel, f_abs in list(paths_modified.items()):
-            if f_abs.endswith(".blend"):
-                f_abs_remap = remap_file(f_rel, f_abs)
-                if os.path.exists(f_abs_remap):
-                    paths_modified[f_rel] = f_abs_remap
+                    remap_jobs.append((paths_dict, f_rel, f_abs_remap, (
+                            f_abs.encode('utf-8'),
+                            dir_remap.encode('utf-8'),
+                            proj_base_b,
+                            )))
+
+        if len(remap_jobs) > 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor() as executor:
+                futures = [
+                        executor.submit(bam_session.blendfile_remap_to_project, *args)
+                        for (_, _, _, args) in remap_jobs]
+                # collect all before archiving (raises exceptions from the sub-processes)
+                remap_results = [future.result() for future in futures]
+            del concurrent, futures
+        else:
+            remap_results = [
+                    bam_session.blendfile_remap_to_project(*args)
+                    for (_, _, _, args) in remap_jobs]
 
-        for f_rel, f_abs in list(paths_add.items()):
-            if f_abs.endswith(".blend"):
-                f_abs_remap = remap_file(f_rel, f_abs)
-                if os.path.exists(f_abs_remap):
-                    paths_add[f_rel] = f_abs_remap
+        for (paths_dict, f_rel, f_abs_remap, _), is_remapped in zip(remap_jobs, remap_results):
+            if is_remapped:
+                paths_dict[f_rel] = f_abs_remap
+        del remap_results
+        del remap_jobs
 
         """
                 deps = deps_remap.get(f_rel)
@@ -1056,10 +1275,26 @@ class bam_commands:
         import zipfile
         temp_zip = os.path.join(session_rootdir, ".bam_tmp.zip")
         with zipfile.ZipFile(temp_zip, 'w', zipfile.ZIP_DEFLATED) as zip_handle:
+            from bam.utils.system import write_files_to_zip
+
+            paths_op = {}
             for paths_dict, op in ((paths_modified, 'M'), (paths_add, 'A')):
-                for (f_rel, f_abs) in paths_dict.items():
-                    print("  packing (%s): %r" % (op, f_abs))
-                    zip_handle.write(f_abs, arcname=f_rel)
+                for f_abs in paths_dict.values():
+                    paths_op[f_abs] = op
+
+            # fixed time & order, so running the same commit again gives the same zip
+            # (and the same upload-id, which allows resuming an interrupted upload).
+            zip_date_time = (1980, 1, 1, 0, 0, 0)
+
+            write_files_to_zip(
+                    zip_handle,
+                    sorted((f_abs, f_rel)
+                           for paths_dict in (paths_modified, paths_add)
+                           for (f_rel, f_abs) in paths_dict.items()),
+                    date_time=zip_date_time,
+                    report=lambda f_abs, f_rel: print("  packing (%s): %r" % (paths_op[f_abs], f_abs)),
+                    )
+            del write_files_to_zip, paths_op
 
             # make a paths remap that only includes modified files
             # TODO(cam), from 'packer.py'
@@ -1072,7 +1307,7 @@ class bam_commands:
                     for f_rel in paths_add})
 
             # paths_remap_subset.update(paths_remap_subset_add)
-            write_json_to_zip(zip_handle, ".bam_paths_remap.json", paths_remap_subset)
+            write_json_to_zip(zip_handle, ".bam_paths_remap.json", paths_remap_subset, date_time=zip_date_time)
 
             # build a list of path manipulation operations
             paths_ops = {}
@@ -1082,38 +1317,82 @@ class bam_commands:
                 f_abs_remote = paths_remap[f_rel]
                 paths_ops[f_abs_remote] = 'D'
 
-            write_json_to_zip(zip_handle, ".bam_paths_ops.json", paths_ops)
+            write_json_to_zip(zip_handle, ".bam_paths_ops.json", paths_ops, date_time=zip_date_time)
             log.debug(paths_ops)
 
 
         # --------------
         # Commit Request
+        upload_id = bam_session.request_upload(cfg, temp_zip)
+
         payload = {
             "command": "commit",
             "arguments": json.dumps({
                 'message': message,
+                'upload_id': upload_id,
                 }),
             }
-        files = {
-            "file": open(temp_zip, 'rb'),
-            }
 
         r = requests.put(
                 bam_session.request_url("file"),
                 params=payload,
                 auth=(cfg["user"], cfg["password"]),
-                files=files)
+                )
 
-        files["file"].close()
         os.remove(temp_zip)
 
+        def commit_abort(msg):
+            # nothing was committed, remove temporary files so the commit can run again
+            if os.path.exists(basedir_temp):
+                import shutil
+                shutil.rmtree(basedir_temp)
+            fatal(msg)
+
         try:
             r_json = r.json()
-            print(r_json.get("message", "<empty>"))
         except Exception:
             print(r.text)
+            r_json = {}
+
+        commit_id = r_json.get("commit_id")
+        if r.status_code != 200 or commit_id is None:
+            commit_abort("commit failed (%d): %s" % (r.status_code, r_json.get("message", "<empty>")))
+
+        # the server applies commits in the background, wait until it's done.
+        import time
+        # seconds to wait for the server to apply the commit
+        timeout = 60.0 * 60.0
+        time_end = time.time() + timeout
+        poll_interval = 0.25
+        while r_json.get("status") in {"waiting", "running"}:
+            if time.time() > time_end:
+                commit_abort("commit %d not applied after %d seconds (status %r), "
+                             "check the repository before running the commit again" %
+                             (commit_id, timeout, r_json.get("status")))
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2.0, 4.0)
+            try:
+                r = requests.get(
+                        bam_session.request_url("file"),
+                        params={
+                            "command": "commit_status",
+                            "arguments": json.dumps({"commit_id": commit_id}),
+                            },
+                        auth=(cfg["user"], cfg["password"]),
+                        timeout=60.0,
+                        )
+                if r.status_code != 200:
+                    continue
+                r_json = r.json()
+            except (requests.exceptions.RequestException, ValueError):
+                # try again (until the timeout)
+                continue
+
+        print(r_json.get("message", "<empty>"))
+
+        if r_json.get("status") != "done":
+            commit_abort("commit failed")
 
-        # TODO, handle error cases
         ok = True
         if ok:
 
@@ -1225,9 +1504,15 @@ class bam_commands:
             print(json.dumps(ret))
 
     @staticmethod
-    def list_dir(paths, use_full=False, use_json=False):
+    def list_dir(paths, use_full=False, use_json=False, recursive=False):
         import requests
 
+        # ---------
+        # constants
+        PAGE_SIZE = 10000
+        # number of listings to keep in the cache
+        CACHE_SIZE_MAX = 16
+
         # Load project configuration
         cfg = bam_config.load(abort=True)
 
@@ -1235,33 +1520,77 @@ class bam_commands:
         path = paths[0]
         del paths
 
-        payload = {
-            "path": path,
-            }
-        r = requests.get(
-                bam_session.request_url("file_list"),
-                params=payload,
-                auth=(cfg['user'], cfg['password']),
-                stream=True,
-                )
+        # listings we already have, only downloaded again when changed.
+        # {key: {"etag": etag, "items": items}, ...}
+        cache_id = "list_cache"
+        try:
+            cache = bam_config.load(id_=cache_id)
+        except (OSError, ValueError):
+            cache = {}
+        cache_key = "%s:%d" % (path, recursive)
+        cache_item = cache.get(cache_key)
 
-        r_json = r.json()
-        items = r_json.get("items_list")
-        if items is None:
-            fatal(r_json.get("message", "<empty>"))
+        def request_page(offset, headers=None):
+            payload = {
+                "path": path,
+                "recursive": int(recursive),
+                "offset": offset,
+                "limit": PAGE_SIZE,
+                }
+            return requests.get(
+                    bam_session.request_url("file_list"),
+                    params=payload,
+                    auth=(cfg['user'], cfg['password']),
+                    headers=headers,
+                    )
 
+        r = request_page(0, headers={"If-None-Match": '"%s"' % cache_item["etag"]} if cache_item else None)
+        if r.status_code == 304:
+            items = cache_item["items"]
+        else:
+            r_json = r.json()
+            items = r_json.get("items_list")
+            if items is None:
+                fatal(r_json.get("message", "<empty>"))
+
+            # the listing may change while requesting pages,
+            # the etag is for the entire listing, so we can tell.
+            etag = r.headers.get("ETag", "").strip('"')
+            items_total = r_json.get("items_total", len(items))
+            while len(items) < items_total:
+                r = request_page(len(items))
+                r_json = r.json()
+                items_page = r_json.get("items_list")
+                if items_page is None:
+                    fatal(r_json.get("message", "<empty>"))
+                if (not items_page) or (r.headers.get("ETag", "").strip('"') != etag):
+                    fatal("Directory changed while listing %r, try again" % path)
+                items.extend(items_page)
+
+            if etag:
+                cache.pop(cache_key, None)
+                while len(cache) >= CACHE_SIZE_MAX:
+                    del cache[next(iter(cache))]
+                cache[cache_key] = {"etag": etag, "items": items}
+                bam_config.write(id_=cache_id, data=cache)
+
+        # servers may send more details: (name_short, name_full, file_type, size, mtime)
+        items = [tuple(item[:3]) for item in items]
         items.sort()
 
         if use_json:
             ret = []
             for (name_short, name_full, file_type) in items:
-                ret.append((name_short, file_type))
+                ret.append((name_full if recursive else name_short, file_type))
 
             print(json.dumps(ret))
         else:
             def strip_dot_slash(f):
                 return f[2:] if f.startswith("./") else f
 
+            if recursive:
+                use_full = True
+
             for (name_short, name_full, file_type) in items:
                 if file_type == "dir":
                     print("  %s/" % (strip_dot_slash(name_full) if use_full else name_short))
@@ -1324,24 +1653,37 @@ class bam_commands:
         # Local packing (don't use any project/session stuff)
         from .blend import blendfile_pack
 
-        # TODO(cam) multiple paths
-        path = paths[0]
-        del paths
-
         if use_quiet:
             report = lambda msg: None
         else:
             report = lambda msg: print(msg, end="")
 
-        for msg in blendfile_pack.pack(
-                path.encode('utf-8'),
-                output.encode('utf-8'),
-                'ZIP',
-                all_deps=all_deps,
-                compress_level=compress_level,
-                report=report,
-                ):
-            pass
+        if len(paths) == 1:
+            for msg in blendfile_pack.pack(
+                    paths[0].encode('utf-8'),
+                    output.encode('utf-8'),
+                    'ZIP',
+                    all_deps=all_deps,
+                    compress_level=compress_level,
+                    report=report,
+                    ):
+                pass
+        else:
+            for p in paths:
+                if not os.path.isfile(p):
+                    fatal("Path %r not found!" % p)
+
+            # shared files are only stored once,
+            # output to a directory unless a zip-file is given.
+            for msg in blendfile_pack.pack_multi(
+                    [p.encode('utf-8') for p in paths],
+                    output.encode('utf-8'),
+                    'ZIP' if output.lower().endswith(".zip") else 'FILE',
+                    all_deps=all_deps,
+                    compress_level=compress_level,
+                    report=report,
+                    ):
+                pass
 
     @staticmethod
     def remap_start(
@@ -1355,20 +1697,22 @@ class bam_commands:
                 fatal("Path %r not found!" % p)
         paths = [p.encode('utf-8') for p in paths]
 
-        if os.path.exists(filepath_remap):
-            fatal("Remap in progress, run with 'finish' or remove %r" % filepath_remap)
-
         from bam.blend import blendfile_path_remap
-        remap_data = blendfile_path_remap.start(
-                paths,
+
+        # an interrupted 'start' continues where it stopped.
+        if os.path.exists(filepath_remap):
+            try:
+                remap_status = blendfile_path_remap.status(filepath_remap)
+            except ValueError as ex:
+                fatal("%s, run with 'reset' to start again" % str(ex))
+            if remap_status == "complete":
+                fatal("Remap in progress, run with 'finish' or remove %r" % filepath_remap)
+
+        blendfile_path_remap.start(
+                paths, filepath_remap,
                 use_json=use_json,
                 )
 
-        with open(filepath_remap, 'wb') as fh:
-            import pickle
-            pickle.dump(remap_data, fh, pickle.HIGHEST_PROTOCOL)
-            del pickle
-
     @staticmethod
     def remap_finish(
             paths,
@@ -1387,14 +1731,16 @@ class bam_commands:
         if not os.path.exists(filepath_remap):
             fatal("Remap not started, run with 'start', (%r not found)" % filepath_remap)
 
-        with open(filepath_remap, 'rb') as fh:
-            import pickle
-            remap_data = pickle.load(fh)
-            del pickle
-
         from bam.blend import blendfile_path_remap
+        try:
+            remap_status = blendfile_path_remap.status(filepath_remap)
+        except ValueError as ex:
+            fatal("%s, run with 'reset' to start again" % str(ex))
+        if remap_status != "complete":
+            fatal("Remap not complete, run with 'start' to continue (%r)" % filepath_remap)
+
         blendfile_path_remap.finish(
-                paths, remap_data,
+                paths, filepath_remap,
                 force_relative=force_relative,
                 dry_run=dry_run,
                 use_json=use_json,
@@ -1410,6 +1756,10 @@ class bam_commands:
         filepath_remap = "bam_remap.data"
         if os.path.exists(filepath_remap):
             os.remove(filepath_remap)
+            # left over from an interrupted remap (sqlite journal)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(filepath_remap + suffix):
+                    os.remove(filepath_remap + suffix)
         else:
             fatal("remapping not started, nothing to do!")
 
@@ -1589,6 +1939,10 @@ def create_argparse_list(subparsers):
             "-f", "--full", dest="full", action='store_true',
             help="Show the full paths",
             )
+    subparse.add_argument(
+            "-r", "--recursive", dest="recursive", action='store_true',
+            help="List the contents of all sub-directories",
+            )
 
     init_argparse_common(subparse, use_json=True)
 
@@ -1598,6 +1952,7 @@ def create_argparse_list(subparsers):
                     args.paths or ["."],
                     use_full=args.full,
                     use_json=args.json,
+                    recursive=args.recursive,
                     ),
                     )
 
@@ -1647,6 +2002,15 @@ def create_argparse_pack(subparsers):
 
        # pack a blend with maximum compression for online downloads
        bam pack /path/to/scene.blend --output my_scene.zip --compress=best
+
+    Multiple blend files can be packed together, files they share are only stored once.
+    The output keeps the layout of the blend files (relative to the directory they have in common),
+    ``.bam_pack_manifest.json`` lists the dependencies of each blend file.
+
+    .. code-block:: sh
+
+       # pack all shots of a sequence into a directory
+       bam pack shots/*/*.blend --output /path/to/farm/sequence
     """,
             formatter_class=argparse.RawDescriptionHelpFormatter,
             )
@@ -70,8 +70,12 @@ def uuid_from_file(fn, block_size=1 << 20):
         return hex(size)[2:] + sha1.hexdigest()
 
 
-def write_json_to_zip(zip_handle, path, data=None):
+def write_json_to_zip(zip_handle, path, data=None, date_time=None):
     import json
+    if date_time is not None:
+        import zipfile
+        path = zipfile.ZipInfo(path, date_time)
+        path.compress_type = zip_handle.compression
     zip_handle.writestr(
             path,
             json.dumps(
@@ -123,3 +127,145 @@ def is_compressed_filetype(filepath):
         # '.gz', '.tgz',
         # '.zip',
         }
+
+
+def zip_compress_type(filepath, compress_type):
+    """
+    Return the compression to use for ``filepath`` in a zip,
+    files which are already compressed are stored.
+    """
+    import zipfile
+    if isinstance(filepath, str):
+        filepath = filepath.encode('utf-8')
+    if compress_type != zipfile.ZIP_STORED and is_compressed_filetype(filepath):
+        return zipfile.ZIP_STORED
+    return compress_type
+
+
+def zip_entry_matches_file(zinfo, filepath, block_size=1 << 20):
+    """
+    Check if a zip entry holds the same data as ``filepath``,
+    (compares the size & CRC, times are ignored since zip times are too coarse).
+    """
+    import os
+    import zlib
+    if os.path.getsize(filepath) != zinfo.file_size:
+        return False
+    crc = 0
+    with open(filepath, 'rb') as fh:
+        while True:
+            data = fh.read(block_size)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return crc == zinfo.CRC
+
+
+def _zip_copy_raw_supported(zip_handle):
+    """
+    Check the ZipFile has the attributes ``zip_copy_raw`` uses.
+    """
+    import zipfile
+    return (
+        all(hasattr(zip_handle, attr) for attr in ("fp", "start_dir", "filelist", "NameToInfo", "_didModify", "_writing")) and
+        hasattr(zipfile, "sizeFileHeader") and hasattr(zipfile, "stringFileHeader") and
+        hasattr(zipfile.ZipInfo, "FileHeader")
+    )
+
+
+def zip_copy_raw(zip_handle, zip_src, zinfo_src):
+    """
+    Copy an entry from another zip without decompressing it.
+
+    The zipfile module has no public API to write data which is already compressed,
+    so this writes the entry as ``ZipFile.write`` does, using attributes of the ZipFile
+    which CPython has had since 3.6 (see ``_zip_copy_raw_supported``).
+    When they're missing the entry is decompressed & compressed again instead.
+
+    :arg zip_src: The zip to copy from (opened for reading).
+    :arg zinfo_src: The entry in ``zip_src`` to copy.
+    """
+    import zipfile
+    import struct
+
+    # sizes & crc are known, no need for a data descriptor (flag 0x08)
+    zinfo = zipfile.ZipInfo(zinfo_src.filename, zinfo_src.date_time)
+    zinfo.compress_type = zinfo_src.compress_type
+    zinfo.flag_bits = zinfo_src.flag_bits & ~0x08
+    zinfo.create_system = zinfo_src.create_system
+    zinfo.external_attr = zinfo_src.external_attr
+
+    if not (_zip_copy_raw_supported(zip_handle) and hasattr(zip_src, "fp")):
+        import shutil
+        with zip_src.open(zinfo_src) as fh_src, zip_handle.open(zinfo, 'w') as fh_dst:
+            shutil.copyfileobj(fh_src, fh_dst, 1 << 20)
+        return
+
+    # same checks as 'ZipFile.write'
+    if zip_handle.fp is None or zip_handle.mode not in {'w', 'x', 'a'}:
+        raise ValueError("Attempt to write to ZIP archive that was already closed or is read-only")
+    if zip_handle._writing:
+        raise ValueError("Can't write to ZIP archive while an open writing handle exists")
+
+    # skip the local header, its extra field may not match the central directory.
+    fp_src = zip_src.fp
+    fp_src.seek(zinfo_src.header_offset)
+    header = fp_src.read(zipfile.sizeFileHeader)
+    if header[0:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile("Bad magic number for file header: %r" % zinfo_src.filename)
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    fp_src.seek(name_len + extra_len, 1)
+
+    zinfo.CRC = zinfo_src.CRC
+    zinfo.compress_size = zinfo_src.compress_size
+    zinfo.file_size = zinfo_src.file_size
+
+    zip_handle.fp.seek(zip_handle.start_dir)
+    zinfo.header_offset = zip_handle.start_dir
+    zip_handle.fp.write(zinfo.FileHeader())
+    remaining = zinfo.compress_size
+    while remaining:
+        data = fp_src.read(min(remaining, 1 << 20))
+        if not data:
+            raise zipfile.BadZipFile("Truncated file data: %r" % zinfo_src.filename)
+        zip_handle.fp.write(data)
+        remaining -= len(data)
+    zip_handle.start_dir = zip_handle.fp.tell()
+    zip_handle.filelist.append(zinfo)
+    zip_handle.NameToInfo[zinfo.filename] = zinfo
+    zip_handle._didModify = True
+
+
+def write_files_to_zip(
+        zip_handle, files,
+        compress_type=None,
+        date_time=None,
+        report=None,
+        ):
+    """
+    Write files into a zip, compressed files are stored (see ``zip_compress_type``),
+    the remaining files use ``compress_type``.
+
+    :arg files: [(filepath, arcname), ...]
+    :arg compress_type: ``zipfile.ZIP_STORED`` or ``zipfile.ZIP_DEFLATED``,
+       defaults to the compression of ``zip_handle``.
+    :arg date_time: Use this time for all entries instead of the files modification time,
+       so writing the same files gives the same zip.
+    """
+    import zipfile
+    import shutil
+
+    if compress_type is None:
+        compress_type = zip_handle.compression
+    if compress_type not in {zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED}:
+        raise ValueError("unsupported compression type: %r" % compress_type)
+
+    for filepath, arcname in files:
+        if report is not None:
+            report(filepath, arcname)
+        zinfo = zipfile.ZipInfo.from_file(filepath, arcname=arcname)
+        if date_time is not None:
+            zinfo.date_time = date_time
+        zinfo.compress_type = zip_compress_type(filepath, compress_type)
+        with open(filepath, 'rb') as fh_src, zip_handle.open(zinfo, 'w') as fh_dst:
+            shutil.copyfileobj(fh_src, fh_dst, 1 << 20)
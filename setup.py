@@ -50,5 +50,6 @@ setup(
         ],
     },
     install_requires=requires,
+    python_requires='>=3.6',
 )
 
@@ -132,6 +132,8 @@ PROJECT_NAME = "test_project"
 
 # running scripts next to this one!
 CURRENT_DIR = os.path.dirname(__file__)
+# blend files used by tests which don't need blender
+BLENDS_DIR = os.path.join(CURRENT_DIR, "blends")
 
 
 def args_as_string(args):
@@ -1750,6 +1752,809 @@ class BamRemapTest(BamSimpleTestCase):
         self.assertEqual(ret[1][3], "OK")
 
 
+class BamDeltaTest(BamSimpleTestCase):
+    """
+    Test block level delta transfer (used by 'checkout_download').
+    """
+
+    @staticmethod
+    def delta_roundtrip(filepath_old, filepath_new):
+        """
+        Rebuild 'filepath_new' from 'filepath_old' the way the client does,
+        return (data, bytes_sent).
+        """
+        from bam.blend import blendfile_delta
+        data_old = file_quick_read(filepath_old)
+        signature = json.loads(json.dumps(blendfile_delta.signature_from_file(filepath_old)))
+        data = []
+        bytes_sent = 0
+        for op in blendfile_delta.delta_from_signature(filepath_new, signature):
+            if op[0] == b'COPY':
+                data.append(data_old[op[1]:op[1] + op[2]])
+            else:
+                data.append(op[1])
+                bytes_sent += len(op[1])
+        return b''.join(data), bytes_sent
+
+    def test_delta_unchanged(self):
+        filepath = os.path.join(BLENDS_DIR, "variations", "lib_user.blend")
+        data, bytes_sent = self.delta_roundtrip(filepath, filepath)
+        self.assertEqual(file_quick_read(filepath), data)
+        self.assertEqual(0, bytes_sent)
+
+    def test_delta_blend_modified(self):
+        from bam.blend import blendfile_delta
+        filepath_old = os.path.join(BLENDS_DIR, "variations", "lib_user.blend")
+        filepath_new = os.path.join(TEMP_LOCAL, "lib_user.blend")
+        self.assertTrue(blendfile_delta.is_delta_supported(filepath_old))
+
+        # edit data inside a single chunk
+        bounds = blendfile_delta.chunk_bounds(filepath_old)
+        self.assertTrue(len(bounds) > 2)
+        ofs, size = bounds[2]
+        data_new = bytearray(file_quick_read(filepath_old))
+        data_new[ofs + size // 2:ofs + size // 2 + 4] = b'\xff\xfe\xfd\xfc'
+        file_quick_write(filepath_new, data=bytes(data_new))
+
+        data, bytes_sent = self.delta_roundtrip(filepath_old, filepath_new)
+        self.assertEqual(bytes(data_new), data)
+        self.assertEqual(size, bytes_sent)
+
+    def test_delta_blend_inserted(self):
+        from bam.blend import blendfile
+        from bam.blend import blendfile_delta
+        filepath_old = os.path.join(BLENDS_DIR, "variations", "lib_user.blend")
+        filepath_new = os.path.join(TEMP_LOCAL, "lib_user.blend")
+
+        # insert a new data block where a chunk starts,
+        # only the chunk it's appended to is sent, the chunks after it are still found.
+        bounds = blendfile_delta.chunk_bounds(filepath_old)
+        ofs = bounds[2][0]
+        data_old = file_quick_read(filepath_old)
+        with open(filepath_old, 'rb') as handle:
+            header = blendfile.BlendFileHeader(handle)
+        block = header.create_block_header_struct().pack(b'DATA', 16, 1, 0, 1) + b'\0' * 16
+        file_quick_write(filepath_new, data=data_old[:ofs] + block + data_old[ofs:])
+
+        data, bytes_sent = self.delta_roundtrip(filepath_old, filepath_new)
+        self.assertEqual(data_old[:ofs] + block + data_old[ofs:], data)
+        self.assertEqual(bounds[1][1] + len(block), bytes_sent)
+
+    def test_delta_non_blend(self):
+        from bam.blend import blendfile_delta
+        filepath_old = os.path.join(TEMP_LOCAL, "data.bin")
+        filepath_new = os.path.join(TEMP_LOCAL, "data_new.bin")
+        data_old = bytes(range(256)) * ((blendfile_delta.CHUNK_SIZE_FIXED * 3) // 256)
+        file_quick_write(filepath_old, data=data_old)
+        file_quick_write(filepath_new, data=data_old[:10] + b'changed' + data_old[17:])
+        self.assertFalse(blendfile_delta.is_delta_supported(filepath_old))
+
+        data, bytes_sent = self.delta_roundtrip(filepath_old, filepath_new)
+        self.assertEqual(file_quick_read(filepath_new), data)
+        # in-place edits only resend the chunk they're in
+        self.assertEqual(blendfile_delta.CHUNK_SIZE_FIXED, bytes_sent)
+
+    def test_delta_blend_gzip(self):
+        import gzip
+        from bam.blend import blendfile_delta
+        filepath_old = os.path.join(TEMP_LOCAL, "lib_user.blend")
+        filepath_new = os.path.join(TEMP_LOCAL, "lib_user_new.blend")
+        data = file_quick_read(BLENDS_DIR, os.path.join("variations", "lib_user.blend"))
+        file_quick_write(filepath_old, data=gzip.compress(data))
+        file_quick_write(filepath_new, data=gzip.compress(data + b'_'))
+        self.assertFalse(blendfile_delta.is_delta_supported(filepath_old))
+
+        data, bytes_sent = self.delta_roundtrip(filepath_old, filepath_new)
+        self.assertEqual(file_quick_read(filepath_new), data)
+
+    def test_delta_empty(self):
+        filepath_empty = os.path.join(TEMP_LOCAL, "empty.bin")
+        filepath_data = os.path.join(TEMP_LOCAL, "data.bin")
+        file_quick_write(filepath_empty, data=b'')
+        file_quick_write(filepath_data, data=b'data')
+
+        self.assertEqual((b'', 0), self.delta_roundtrip(filepath_empty, filepath_empty))
+        self.assertEqual((b'data', 4), self.delta_roundtrip(filepath_empty, filepath_data))
+        self.assertEqual((b'', 0), self.delta_roundtrip(filepath_data, filepath_empty))
+
+
+class BamZipTest(BamSimpleTestCase):
+    """
+    Test writing zips (used by 'commit' & 'pack').
+    """
+
+    @staticmethod
+    def write_files(filepath_zip, files, **kw):
+        import zipfile
+        from bam.utils.system import write_files_to_zip
+        with zipfile.ZipFile(filepath_zip, 'w', zipfile.ZIP_DEFLATED) as zip_handle:
+            write_files_to_zip(zip_handle, files, **kw)
+
+    def test_zip_write_files(self):
+        import zipfile
+        files = []
+        for name, data in (
+                ("a.txt", b"text " * 1000),
+                ("b.png", b"\x89PNG" + bytes(range(256)) * 8),
+                ("c.blend", b""),
+                ):
+            files.append((os.path.join(TEMP_LOCAL, name), "dir/" + name))
+            file_quick_write(files[-1][0], data=data)
+        filepath_zip = os.path.join(TEMP_LOCAL, "test.zip")
+        self.write_files(filepath_zip, files)
+
+        with zipfile.ZipFile(filepath_zip, 'r') as zip_handle:
+            self.assertIsNone(zip_handle.testzip())
+            self.assertEqual([f_rel for f_abs, f_rel in files], zip_handle.namelist())
+            for f_abs, f_rel in files:
+                self.assertEqual(file_quick_read(f_abs), zip_handle.read(f_rel))
+            # already compressed files are stored
+            self.assertEqual(zipfile.ZIP_DEFLATED, zip_handle.getinfo("dir/a.txt").compress_type)
+            self.assertEqual(zipfile.ZIP_STORED, zip_handle.getinfo("dir/b.png").compress_type)
+
+    def test_zip_write_files_compress_type(self):
+        import zipfile
+        filepath = os.path.join(TEMP_LOCAL, "a.txt")
+        file_quick_write(filepath, data=b"text " * 1000)
+        filepath_zip = os.path.join(TEMP_LOCAL, "test.zip")
+
+        self.write_files(filepath_zip, [(filepath, "a.txt")], compress_type=zipfile.ZIP_STORED)
+        with zipfile.ZipFile(filepath_zip, 'r') as zip_handle:
+            self.assertEqual(zipfile.ZIP_STORED, zip_handle.getinfo("a.txt").compress_type)
+
+        with self.assertRaises(ValueError):
+            self.write_files(filepath_zip, [(filepath, "a.txt")], compress_type=zipfile.ZIP_BZIP2)
+
+    def test_zip_entry_matches_file(self):
+        # changes which keep the size (and time) of a file are found.
+        import zipfile
+        from bam.utils.system import zip_entry_matches_file
+        filepath = os.path.join(TEMP_LOCAL, "a.png")
+        file_quick_write(filepath, data=b"data_a" * 1000)
+        filepath_zip = os.path.join(TEMP_LOCAL, "test.zip")
+        self.write_files(filepath_zip, [(filepath, "a.png")])
+        st = os.stat(filepath)
+
+        with zipfile.ZipFile(filepath_zip, 'r') as zip_handle:
+            zinfo = zip_handle.getinfo("a.png")
+            self.assertTrue(zip_entry_matches_file(zinfo, filepath))
+
+            file_quick_write(filepath, data=b"data_b" * 1000)
+            os.utime(filepath, ns=(st.st_atime_ns, st.st_mtime_ns))
+            self.assertFalse(zip_entry_matches_file(zinfo, filepath))
+
+            file_quick_write(filepath, data=b"data_a" * 1001)
+            self.assertFalse(zip_entry_matches_file(zinfo, filepath))
+
+    def test_zip_copy_raw(self):
+        import zipfile
+        from unittest import mock
+        from bam.utils import system
+        from bam.utils.system import zip_copy_raw
+        files = []
+        for name, data in (("a.txt", b"text " * 1000), ("b.png", b"png"), ("c.txt", b"")):
+            files.append((os.path.join(TEMP_LOCAL, name), name))
+            file_quick_write(files[-1][0], data=data)
+        filepath_zip_src = os.path.join(TEMP_LOCAL, "src.zip")
+        filepath_zip_dst = os.path.join(TEMP_LOCAL, "dst.zip")
+        self.write_files(filepath_zip_src, files)
+
+        # also when the ZipFile doesn't support raw copies (compressing again)
+        with zipfile.ZipFile(filepath_zip_src, 'r') as zip_src:
+            self.assertTrue(system._zip_copy_raw_supported(zip_src))
+        for is_supported in (True, False):
+            with zipfile.ZipFile(filepath_zip_src, 'r') as zip_src, \
+                    zipfile.ZipFile(filepath_zip_dst, 'w', zipfile.ZIP_DEFLATED) as zip_handle, \
+                    mock.patch.object(system, "_zip_copy_raw_supported", return_value=is_supported):
+                zip_handle.writestr("new.txt", b"new")
+                for zinfo in zip_src.infolist():
+                    zip_copy_raw(zip_handle, zip_src, zinfo)
+
+            with zipfile.ZipFile(filepath_zip_src, 'r') as zip_src, \
+                    zipfile.ZipFile(filepath_zip_dst, 'r') as zip_handle:
+                self.assertIsNone(zip_handle.testzip())
+                self.assertEqual(["new.txt"] + [f_rel for f_abs, f_rel in files], zip_handle.namelist())
+                for f_abs, f_rel in files:
+                    self.assertEqual(file_quick_read(f_abs), zip_handle.read(f_rel))
+                    zinfo_src = zip_src.getinfo(f_rel)
+                    zinfo_dst = zip_handle.getinfo(f_rel)
+                    self.assertEqual(
+                            (zinfo_src.compress_type, zinfo_src.CRC, zinfo_src.date_time),
+                            (zinfo_dst.compress_type, zinfo_dst.CRC, zinfo_dst.date_time))
+
+    def test_zip_copy_raw_writing(self):
+        # an entry can't be copied while another is being written
+        import zipfile
+        from bam.utils.system import zip_copy_raw
+        filepath_zip_src = os.path.join(TEMP_LOCAL, "src.zip")
+        with zipfile.ZipFile(filepath_zip_src, 'w') as zip_handle:
+            zip_handle.writestr("a.txt", b"text")
+
+        with zipfile.ZipFile(filepath_zip_src, 'r') as zip_src, \
+                zipfile.ZipFile(os.path.join(TEMP_LOCAL, "dst.zip"), 'w') as zip_handle:
+            with zip_handle.open("b.txt", 'w') as fh:
+                fh.write(b"text")
+                with self.assertRaises(ValueError):
+                    zip_copy_raw(zip_handle, zip_src, zip_src.getinfo("a.txt"))
+
+    def test_zip_write_files_date_time(self):
+        # the same files written at another time give the same zip (commit upload-id's depend on this).
+        from bam.utils.system import write_json_to_zip
+        import zipfile
+        date_time = (1980, 1, 1, 0, 0, 0)
+        files = []
+        for name, data in (("a.txt", b"text " * 1000), ("b.png", b"png")):
+            files.append((os.path.join(TEMP_LOCAL, name), name))
+            file_quick_write(files[-1][0], data=data)
+
+        data = []
+        for mtime in (1000000000, 1100000000):
+            for f_abs, _ in files:
+                os.utime(f_abs, (mtime, mtime))
+            filepath_zip = os.path.join(TEMP_LOCAL, "test.zip")
+            self.write_files(filepath_zip, files, date_time=date_time)
+            with zipfile.ZipFile(filepath_zip, 'a') as zip_handle:
+                write_json_to_zip(zip_handle, "data.json", {"a": 1}, date_time=date_time)
+            data.append(file_quick_read(filepath_zip))
+        self.assertEqual(data[0], data[1])
+
+
+class BamUploadTest(BamSimpleTestCase):
+    """
+    Test chunked commit uploads (client side, the server is simulated).
+    """
+
+    def upload(self, data, data_server=b'', chunk_size=100, put_fail=()):
+        """
+        Upload 'data' to a server which has 'data_server' already,
+        puts with an index in 'put_fail' fail.
+
+        Returns the data at the server.
+        """
+        import hashlib
+        from unittest import mock
+        from bam.cli import bam_session
+
+        filepath = os.path.join(TEMP_LOCAL, "upload.zip")
+        file_quick_write(filepath, data=data)
+        server = {"data": data_server, "puts": 0}
+
+        def response(**kw):
+            r = mock.Mock()
+            r.json.return_value = kw
+            return r
+
+        def request_get(url, params=None, **kw):
+            self.assertEqual("commit_upload_status", params["command"])
+            return response(offset=len(server["data"]))
+
+        def request_put(url, params=None, files=None, **kw):
+            # same as 'FileAPI.put' for 'commit_upload'
+            import requests
+            args = json.loads(params["arguments"])
+            server["puts"] += 1
+            if server["puts"] in put_fail:
+                raise requests.exceptions.ConnectionError()
+            chunk = files["file"]
+            if hashlib.sha1(chunk).hexdigest() != args["checksum"]:
+                return response(offset=len(server["data"]))
+            if args["offset"] == 0 and args["truncate"]:
+                server["data"] = b''
+            if args["offset"] != len(server["data"]):
+                return response(offset=len(server["data"]))
+            server["data"] += chunk
+            return response(offset=len(server["data"]))
+
+        import io
+        import contextlib
+        with mock.patch("requests.get", request_get), \
+                mock.patch("requests.put", request_put), \
+                mock.patch("time.sleep"), \
+                mock.patch.object(bam_session, "request_url", lambda req_path: req_path), \
+                contextlib.redirect_stdout(io.StringIO()):
+            upload_id = bam_session.request_upload({"user": "", "password": ""}, filepath, chunk_size=chunk_size)
+
+        from bam.utils.system import uuid_from_file
+        self.assertEqual(uuid_from_file(filepath), upload_id)
+        return server["data"]
+
+    def test_upload(self):
+        data = bytes(range(256)) * 4
+        self.assertEqual(data, self.upload(data))
+        self.assertEqual(data, self.upload(data, chunk_size=len(data)))
+        self.assertEqual(b'', self.upload(b''))
+
+    def test_upload_resume(self):
+        data = bytes(range(256)) * 4
+        # resume a previous upload
+        self.assertEqual(data, self.upload(data, data_server=data[:300]))
+        # failed requests
+        self.assertEqual(data, self.upload(data, put_fail=(1, 3, 4)))
+
+    def test_upload_larger(self):
+        # the server has more data than the upload (corrupt), upload again.
+        data = bytes(range(256)) * 4
+        self.assertEqual(data, self.upload(data, data_server=data + b'junk'))
+        self.assertEqual(data, self.upload(data, data_server=data * 2, put_fail=(1,)))
+
+
+class BamRemapDataTest(BamSimpleTestCase):
+    """
+    Test remapping the blend files in 'blends/' (calling 'blendfile_path_remap' directly).
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.remap_dir = os.path.join(TEMP_LOCAL, "remap").encode('utf-8')
+        for dirname in ("multi_level", "variations"):
+            shutil.copytree(os.path.join(BLENDS_DIR, dirname), os.path.join(self.remap_dir.decode('utf-8'), dirname))
+        self.filepath_remap = os.path.join(TEMP_LOCAL, "bam_remap.data")
+
+    def remap_path(self, *parts):
+        return os.path.join(self.remap_dir, *(p.encode('utf-8') for p in parts))
+
+    def remap_start(self):
+        from bam.blend import blendfile_path_remap
+        blendfile_path_remap.start([self.remap_dir], self.filepath_remap, is_quiet=True)
+
+    def remap_finish(self):
+        from bam.blend import blendfile_path_remap
+        blendfile_path_remap.finish([self.remap_dir], self.filepath_remap, is_quiet=True)
+
+    def remap_move(self, src, dst):
+        os.makedirs(os.path.dirname(self.remap_path(dst)), exist_ok=True)
+        shutil.move(self.remap_path(src), self.remap_path(dst))
+
+    @staticmethod
+    def blend_deps(filepath):
+        from bam.blend import blendfile_path_walker
+        return sorted(
+                fp.filepath for fp, _ in blendfile_path_walker.FilePath.visit_from_blend(
+                        filepath, readonly=True, recursive=False))
+
+    def assertRemapMoved(self):
+        # expected paths, after moving files as done by 'remap_move_all'
+        self.assertEqual(
+                [b'//../../../multi_level/abs/path/house_abs.blend', b'//rel/path/house_rel.blend'],
+                self.blend_deps(self.remap_path("moved", "deeper", "subdir2", "house_lib_user.blend")))
+        self.assertEqual(
+                [b'//../moved/cone_moved.blend'],
+                self.blend_deps(self.remap_path("variations", "lib_user.blend")))
+        self.assertEqual(
+                [b'//lib_user.blend'],
+                self.blend_deps(self.remap_path("variations", "lib_endpoint.blend")))
+
+    def remap_move_all(self):
+        self.remap_move("multi_level/subdir", "moved/deeper/subdir2")
+        self.remap_move("variations/cone.blend", "moved/cone_moved.blend")
+
+    def test_remap_map_ordered(self):
+        from bam.blend.blendfile_path_remap import _map_ordered
+        items = list(range(100))
+        self.assertEqual([str(i) for i in items], list(_map_ordered(str, items, jobs=4)))
+        self.assertEqual([str(i) for i in items], list(_map_ordered(str, items, use_processes=True, jobs=2)))
+        self.assertEqual([], list(_map_ordered(str, [], jobs=4)))
+
+    def test_remap_moved(self):
+        self.remap_start()
+        self.remap_move_all()
+        self.remap_finish()
+        self.assertRemapMoved()
+
+
+    def test_remap_uuid_partial(self):
+        from bam.blend.blendfile_path_remap import _uuid_from_file, _uuid_partial_from_file
+        filepath = self.remap_path("variations", "cone.blend")
+        data = file_quick_read(filepath)
+        self.assertTrue(len(data) > (1 << 16) * 3)
+        filepath_middle = self.remap_path("middle.bin")
+        filepath_end = self.remap_path("end.bin")
+        # only differs in the middle (not checked by the partial uuid)
+        file_quick_write(filepath_middle, data=data[:len(data) // 2] + b'\xff' + data[len(data) // 2 + 1:])
+        file_quick_write(filepath_end, data=data[:-1] + b'\xff')
+
+        self.assertEqual(_uuid_partial_from_file(filepath), _uuid_partial_from_file(filepath_middle))
+        self.assertNotEqual(_uuid_from_file(filepath), _uuid_from_file(filepath_middle))
+        self.assertNotEqual(_uuid_partial_from_file(filepath), _uuid_partial_from_file(filepath_end))
+
+    def test_remap_copied(self):
+        # copied files (which can't be found by their inode) are found by their contents,
+        # other files of the same size are skipped.
+        self.remap_start()
+        filepath = self.remap_path("variations", "cone.blend")
+        data = file_quick_read(filepath)
+        file_quick_write(self.remap_path("a_middle.bin"), data=data[:len(data) // 2] + b'\xff' + data[len(data) // 2 + 1:])
+        file_quick_write(self.remap_path("a_end.bin"), data=data[:-1] + b'\xff')
+        os.makedirs(self.remap_path("moved"))
+        shutil.copy(filepath, self.remap_path("moved", "cone_moved.blend"))
+        os.remove(filepath)
+        self.remap_move("multi_level/subdir", "moved/deeper/subdir2")
+
+        self.remap_finish()
+        self.assertRemapMoved()
+
+    def test_remap_moved_inode(self):
+        # moved files are found by their inode, without reading them.
+        from unittest import mock
+        from bam.blend import blendfile_path_remap
+        self.remap_start()
+        self.remap_move_all()
+
+        def uuid_fail(fn):
+            raise AssertionError("file hashed %r" % fn)
+        with mock.patch.object(blendfile_path_remap, "_uuid_from_file", uuid_fail), \
+                mock.patch.object(blendfile_path_remap, "_uuid_partial_from_file", uuid_fail):
+            self.remap_finish()
+        self.assertRemapMoved()
+
+    def test_remap_moved_inode_modified(self):
+        # a moved file which is modified (keeping its size) isn't matched by its inode.
+        self.remap_start()
+        self.remap_move_all()
+        filepath = self.remap_path("moved", "cone_moved.blend")
+        data = bytearray(file_quick_read(filepath))
+        data[-1] ^= 0xff
+        file_quick_write(filepath, data=bytes(data))
+
+        self.remap_finish()
+        self.assertEqual(
+                [b'//cone.blend'],
+                self.blend_deps(self.remap_path("variations", "lib_user.blend")))
+
+    def test_remap_data_status(self):
+        from bam.blend import blendfile_path_remap
+        file_quick_write(self.filepath_remap, data=b"not a remap file")
+        with self.assertRaises(ValueError):
+            blendfile_path_remap.status(self.filepath_remap)
+        os.remove(self.filepath_remap)
+
+        self.remap_start()
+        self.assertEqual("complete", blendfile_path_remap.status(self.filepath_remap))
+
+    def test_remap_start_resume(self):
+        # an interrupted 'start' continues where it stopped.
+        from unittest import mock
+        from bam.blend import blendfile_path_remap
+        file_info_orig = blendfile_path_remap._file_info
+
+        def file_info_interrupt(fn):
+            if fn.endswith(b"lib_user.blend"):
+                raise KeyboardInterrupt
+            return file_info_orig(fn)
+        with mock.patch.object(blendfile_path_remap, "_file_info", file_info_interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.remap_start()
+        self.assertEqual("partial", blendfile_path_remap.status(self.filepath_remap))
+        with self.assertRaises(ValueError):
+            self.remap_finish()
+
+        self.remap_start()
+        self.assertEqual("complete", blendfile_path_remap.status(self.filepath_remap))
+        self.remap_move_all()
+        self.remap_finish()
+        self.assertRemapMoved()
+
+    def test_remap_edits_coalesce(self):
+        from bam.blend.blendfile_path_walker import utils
+        self.assertEqual([], list(utils.binary_edits_coalesce([])))
+        self.assertEqual(
+                [(0, b'abcd'), (10, b'xy')],
+                list(utils.binary_edits_coalesce([(0, b'ab'), (2, b'cd'), (10, b'xy')])))
+        # overlapping, later edits take precedence
+        self.assertEqual(
+                [(4, b'aXYd'), (9, b'z')],
+                list(utils.binary_edits_coalesce([(4, b'abcd'), (5, b'XY'), (9, b'z')])))
+
+    def test_remap_edits_apply(self):
+        import gzip
+        from bam.blend.blendfile_path_walker import utils
+        data = bytes(range(64))
+        edits = [(4, b'ab'), (6, b'cd'), (32, b'ef')]
+        data_expect = data[:4] + b'abcd' + data[8:32] + b'ef' + data[34:]
+
+        filepath = self.remap_path("edit.blend")
+        file_quick_write(filepath, data=data)
+        utils.binary_edits_apply(filepath, edits)
+        self.assertEqual(data_expect, file_quick_read(filepath))
+        # applying again is harmless
+        utils.binary_edits_apply(filepath, edits)
+        self.assertEqual(data_expect, file_quick_read(filepath))
+
+        # offsets are into the uncompressed data
+        file_quick_write(filepath, data=gzip.compress(data))
+        utils.binary_edits_apply(filepath, edits)
+        self.assertEqual(data_expect, gzip.decompress(file_quick_read(filepath)))
+
+    def test_remap_finish_resume(self):
+        # an interrupted 'finish' continues where it stopped,
+        # blends already written aren't read again.
+        from unittest import mock
+        from bam.blend import blendfile_path_walker
+        self.remap_start()
+        self.remap_move_all()
+
+        binary_edits_apply_orig = blendfile_path_walker.utils.binary_edits_apply
+        filepaths_written = []
+
+        def binary_edits_apply_interrupt(filepath, binary_edits):
+            if filepaths_written:
+                raise KeyboardInterrupt
+            binary_edits_apply_orig(filepath, binary_edits)
+            filepaths_written.append(filepath)
+        with mock.patch.object(blendfile_path_walker.utils, "binary_edits_apply", binary_edits_apply_interrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.remap_finish()
+        self.assertEqual(1, len(filepaths_written))
+
+        def binary_edits_apply_check(filepath, binary_edits):
+            self.assertNotIn(filepath, filepaths_written)
+            binary_edits_apply_orig(filepath, binary_edits)
+        with mock.patch.object(blendfile_path_walker.utils, "binary_edits_apply", binary_edits_apply_check):
+            self.remap_finish()
+        self.assertRemapMoved()
+
+class BamBlendRemapTest(BamSimpleTestCase):
+    """
+    Test remapping the paths of a single blend file (used when committing).
+    """
+
+    def test_blend_remap(self):
+        import gzip
+        from bam.blend import blendfile_pack_restore
+        blendfile_src = os.path.join(BLENDS_DIR, "variations", "lib_user.blend").encode('utf-8')
+        path_dst = os.path.join(TEMP_LOCAL, "remap").encode('utf-8')
+        blendfile_dst = os.path.join(path_dst, b"lib_user.blend")
+        os.makedirs(path_dst)
+
+        # nothing to remap, nothing written
+        self.assertFalse(blendfile_pack_restore.blendfile_remap(
+                blendfile_src, path_dst, deps_remap={"//other.blend": "//x.blend"}))
+        self.assertFalse(os.path.exists(blendfile_dst))
+
+        self.assertTrue(blendfile_pack_restore.blendfile_remap(
+                blendfile_src, path_dst, deps_remap={"//cone.blend": "//lib/cone_remap.blend"}))
+        self.assertEqual([b'//lib/cone_remap.blend'], BamRemapDataTest.blend_deps(blendfile_dst))
+        os.remove(blendfile_dst)
+
+        # gzipped
+        blendfile_src_gzip = os.path.join(TEMP_LOCAL, "lib_user.blend").encode('utf-8')
+        file_quick_write(blendfile_src_gzip, data=gzip.compress(file_quick_read(blendfile_src)))
+        self.assertTrue(blendfile_pack_restore.blendfile_remap(
+                blendfile_src_gzip, path_dst, deps_remap={"//cone.blend": "//lib/cone_remap.blend"}))
+        self.assertEqual([b'//lib/cone_remap.blend'], BamRemapDataTest.blend_deps(blendfile_dst))
+
+    def test_pack_restore(self):
+        # files already in the output directory are replaced
+        from bam.blend import blendfile_pack_restore
+        path_src = os.path.join(TEMP_LOCAL, "src")
+        path_dst = os.path.join(TEMP_LOCAL, "dst")
+        os.makedirs(path_src)
+        os.makedirs(path_dst)
+        for f in ("lib_user.blend", "cone.blend"):
+            shutil.copy(os.path.join(BLENDS_DIR, "variations", f), path_src)
+            file_quick_write(path_dst, f, data=b"old")
+
+        blendfile_pack_restore.pack_restore(
+                path_src.encode('utf-8'), path_dst.encode('utf-8'), {
+                    "lib_user.blend": {"//cone.blend": "//lib/cone_remap.blend"},
+                    "cone.blend": {"//other.blend": "//x.blend"},
+                    })
+
+        self.assertEqual(
+                [b'//lib/cone_remap.blend'],
+                BamRemapDataTest.blend_deps(os.path.join(path_dst, "lib_user.blend").encode('utf-8')))
+        self.assertEqual(
+                file_quick_read(path_src, "cone.blend"),
+                file_quick_read(path_dst, "cone.blend"))
+
+class BamPackTest(BamSimpleTestCase):
+    """
+    Test packing a blend file (using 'blendfile_pack.pack' directly).
+    """
+
+    def test_pack_zip_nested(self):
+        # libraries in other directories (including outside the blend files directory)
+        import zipfile
+        from bam.blend import blendfile_pack
+        path_zip = os.path.join(TEMP_LOCAL, "packed.zip")
+        path_dst = os.path.join(TEMP_LOCAL, "packed")
+        for _ in blendfile_pack.pack(
+                os.path.join(BLENDS_DIR, "multi_level", "subdir", "house_lib_user.blend").encode('utf-8'),
+                path_zip.encode('utf-8'),
+                mode='ZIP',
+                ):
+            pass
+
+        with zipfile.ZipFile(path_zip, 'r') as zip_handle:
+            self.assertEqual(
+                    ["__/abs/path/house_abs.blend", "house_lib_user.blend", "rel/path/house_rel.blend"],
+                    sorted(zip_handle.namelist()))
+            zip_handle.extractall(path_dst)
+
+        blendfile = os.path.join(path_dst, "house_lib_user.blend").encode('utf-8')
+        self.assertEqual(
+                [b'//__/abs/path/house_abs.blend', b'//rel/path/house_rel.blend'],
+                BamRemapDataTest.blend_deps(blendfile))
+
+class BamPackMultiTest(BamSimpleTestCase):
+    """
+    Test packing many blend files at once (using 'blendfile_pack.pack_multi' directly).
+    """
+
+    @staticmethod
+    def pack_multi(blendfiles, path_dst, mode):
+        from bam.blend import blendfile_pack
+        for _ in blendfile_pack.pack_multi(
+                [os.path.join(BLENDS_DIR, f).encode('utf-8') for f in blendfiles],
+                path_dst.encode('utf-8'),
+                mode=mode,
+                base_dir_src=BLENDS_DIR.encode('utf-8'),
+                jobs=2,
+                ):
+            pass
+
+    # blends sharing 'variations/cone.blend' (directly & via 'lib_user.blend')
+    blendfiles = ("variations/lib_endpoint.blend", "variations/lib_user.blend")
+    manifest_expect = {
+        "variations/lib_endpoint.blend": ["variations/cone.blend", "variations/lib_user.blend"],
+        "variations/lib_user.blend": ["variations/cone.blend"],
+        }
+
+    def test_pack_multi_shared_file(self):
+        from bam.blend import blendfile_pack
+        path_dst = os.path.join(TEMP_LOCAL, "packed")
+        self.pack_multi(self.blendfiles, path_dst, 'FILE')
+
+        files = sorted(
+                os.path.relpath(os.path.join(dirpath, f), path_dst)
+                for dirpath, dirnames, filenames in os.walk(path_dst) for f in filenames)
+        self.assertEqual(
+                sorted([blendfile_pack.MANIFEST_NAME, "variations/cone.blend"] + list(self.blendfiles)),
+                files)
+        self.assertEqual(
+                self.manifest_expect,
+                json.loads(file_quick_read(path_dst, blendfile_pack.MANIFEST_NAME, mode='r')))
+        self.assertEqual(
+                file_quick_read(BLENDS_DIR, "variations/cone.blend"),
+                file_quick_read(path_dst, "variations/cone.blend"))
+
+        # paths in the packed blends point to the shared file
+        from bam.blend import blendfile_path_walker
+        for f in self.blendfiles:
+            for fp, _ in blendfile_path_walker.FilePath.visit_from_blend(
+                    os.path.join(path_dst, f).encode('utf-8'), readonly=True, recursive=False):
+                self.assertTrue(os.path.exists(fp.filepath_absolute), fp.filepath_absolute)
+
+    def test_pack_multi_shared_file_zip(self):
+        import zipfile
+        from bam.blend import blendfile_pack
+        path_dst = os.path.join(TEMP_LOCAL, "packed.zip")
+        self.pack_multi(self.blendfiles, path_dst, 'ZIP')
+
+        with zipfile.ZipFile(path_dst, 'r') as zip_handle:
+            self.assertIsNone(zip_handle.testzip())
+            self.assertEqual(
+                    sorted([blendfile_pack.MANIFEST_NAME, "variations/cone.blend"] + list(self.blendfiles)),
+                    sorted(zip_handle.namelist()))
+            self.assertEqual(
+                    self.manifest_expect,
+                    json.loads(zip_handle.read(blendfile_pack.MANIFEST_NAME).decode('utf-8')))
+            self.assertEqual(
+                    file_quick_read(BLENDS_DIR, "variations/cone.blend"),
+                    zip_handle.read("variations/cone.blend"))
+
+class BamSequenceTest(BamSimpleTestCase):
+    """
+    Test finding image sequences (see 'blendfile_path_walker.DirectoryIndex').
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.seq_dir = os.path.join(TEMP_LOCAL, "seq")
+        for f in (
+                "render_0001.png", "render_0002.png", "render_0003.png",
+                "render_0001.exr", "other_01.png", "render.png", "render_0001a.png",
+                ):
+            file_quick_write(self.seq_dir, f, data=b'')
+
+    def test_sequence_find(self):
+        from bam.blend.blendfile_path_walker import utils
+        self.assertEqual(
+                ["render_0001.png", "render_0002.png", "render_0003.png"],
+                sorted(utils.find_sequence_paths(os.path.join(self.seq_dir, "render_0002.png"), use_fullpath=False)))
+        self.assertEqual(
+                [os.path.join(self.seq_dir, "render_0001.exr")],
+                utils.find_sequence_paths(os.path.join(self.seq_dir, "render_0001.exr")))
+        # bytes paths
+        self.assertEqual(
+                [os.path.join(self.seq_dir, "other_01.png").encode('utf-8')],
+                utils.find_sequence_paths(os.path.join(self.seq_dir, "other_01.png").encode('utf-8')))
+        # not part of a sequence
+        self.assertEqual([], utils.find_sequence_paths(os.path.join(self.seq_dir, "render.png")))
+        self.assertEqual([], utils.find_sequence_paths(os.path.join(self.seq_dir, "missing", "render_01.png")))
+
+    def test_sequence_index(self):
+        # each directory is listed once, for all sequences in it.
+        from unittest import mock
+        from bam.blend.blendfile_path_walker import DirectoryIndex
+        dir_index = DirectoryIndex()
+        with mock.patch("os.listdir", side_effect=os.listdir) as listdir:
+            self.assertEqual(
+                    ["render_0001.png", "render_0002.png", "render_0003.png"],
+                    sorted(dir_index.find_sequence_paths(
+                            os.path.join(self.seq_dir, "render_0001.png"), use_fullpath=False)))
+            self.assertEqual(
+                    ["other_01.png"],
+                    dir_index.find_sequence_paths(os.path.join(self.seq_dir, "other_01.png"), use_fullpath=False))
+            self.assertEqual(
+                    ["render_0001.exr"],
+                    dir_index.find_sequence_paths(os.path.join(self.seq_dir, "render_0001.exr"), use_fullpath=False))
+        self.assertEqual(1, listdir.call_count)
+
+class BamBlendFileTest(unittest.TestCase):
+    """
+    Test reading blend files (see 'blendfile').
+    """
+
+    def test_get_array(self):
+        # the same values as calling 'get' for each item
+        from bam.blend import blendfile
+        paths = {
+            b'CustomDataLayer': (b'type', b'uid', b'name', b'data'),
+            b'MEdge': (b'v1', b'v2', b'flag'),
+            b'MPoly': (b'loopstart', b'totloop', b'mat_nr'),
+            }
+        blocks_tested = set()
+        bf = blendfile.open_blend(os.path.join(BLENDS_DIR, "variations", "cone.blend").encode('utf-8'))
+        try:
+            for block in bf.blocks:
+                dna_type_id = bf.structs[block.sdna_index].dna_type_id
+                if block.count < 2 or dna_type_id not in paths:
+                    continue
+                blocks_tested.add(dna_type_id)
+                for path in paths[dna_type_id]:
+                    self.assertEqual(
+                            [block.get(path, base_index=i) for i in range(block.count)],
+                            block.get_array(path))
+                if dna_type_id == b'CustomDataLayer':
+                    self.assertEqual(
+                            [block.get(b'name', use_str=False, base_index=i) for i in range(block.count)],
+                            block.get_array(b'name', use_str=False))
+                with self.assertRaises(KeyError):
+                    block.get_array(b'missing')
+        finally:
+            bf.close()
+        self.assertEqual(set(paths), blocks_tested)
+
+    def test_iter_array(self):
+        # the same blocks as reading each pointer on its own
+        from bam.blend import blendfile
+        from bam.blend.blendfile_path_walker import bf_utils
+
+        def iter_array_single(block, length):
+            header = block.file.header
+            for i in range(length):
+                block.file.handle.seek(block.file_offset + (header.pointer_size * i), os.SEEK_SET)
+                yield block.file.find_block_from_offset(blendfile.DNA_IO.read_pointer(block.file.handle, header))
+
+        bf = blendfile.open_blend(os.path.join(BLENDS_DIR, "variations", "cone.blend").encode('utf-8'))
+        try:
+            # material slots
+            block = bf.find_blocks_from_code(b'ME')[0]
+            array = block.get_pointer(b'mat')
+            sub_blocks = list(bf_utils.iter_array(array, block.get(b'totcol')))
+            self.assertEqual([b'MA'], [sub_block.code for sub_block in sub_blocks])
+
+            # any data can be read as an array of pointers (most won't point to blocks)
+            for block in bf.find_blocks_from_code(b'DATA'):
+                length = block.size // bf.header.pointer_size
+                self.assertEqual(
+                        list(iter_array_single(block, length)),
+                        list(bf_utils.iter_array(block, length)))
+                self.assertEqual([], list(bf_utils.iter_array(block, 0)))
+        finally:
+            bf.close()
+
 if __name__ == '__main__':
     data = global_setup()
     unittest.main(exit=False)
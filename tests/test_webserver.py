@@ -34,13 +34,21 @@ from test_cli import svn_repo_create
 from test_cli import svn_repo_checkout
 from test_cli import file_quick_touch
 from test_cli import file_quick_write
+from test_cli import file_quick_read
 from test_cli import run_check
 from test_cli import wait_for_input
 
 from application.modules.projects.model import Project
 from application.modules.projects.model import ProjectSetting
+from application.modules.resources import DirectoryAPI
+from application.modules.resources.model import Bundle
+from application.modules.resources.model import Commit
+from application.modules.resources.queue import BundleQueue
+from application.modules.resources.queue import bundle_queue
+from application.modules.resources.queue import CommitQueue
 
 import unittest
+from unittest import mock
 import tempfile
 import json
 import shutil
@@ -111,6 +119,8 @@ class ServerTestCase(unittest.TestCase):
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///'+ TMP_DIR +'/test.sqlite'
         app.config['TESTING'] = True
         db.create_all()
+        # listings of the previous test's repository
+        DirectoryAPI.listing_cache_clear()
 
         # os.chmod(TMP_DIR + "/test.sqlite", 0o777)
         # Create a testing project, based on the global configuration (depends on a
@@ -157,10 +167,8 @@ class ServerTestCase(unittest.TestCase):
         a = b64encode(b"username:").decode('ascii')
 
         if method == 'GET':
-            args = ['?',]
-            for k, v in data.items():
-                args.append(k + '=' + v + '&')
-            url = url + ''.join(args)
+            import urllib.parse
+            url = url + '?' + urllib.parse.urlencode(data)
 
         return self.app.open(url,
             method=method,
@@ -186,6 +194,54 @@ class ServerUsageTest(ServerTestCase):
 
 
 
+    def directory_list(self, **args):
+        data = dict(path='')
+        data.update({k: str(v) for k, v in args.items()})
+        res = self.open_with_auth('/{0}/file_list'.format(PROJECT_NAME), 'GET', data=data)
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data.decode('utf-8'))
+
+    def test_directory_list_details(self):
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        os.makedirs(os.path.join(path_svn_checkout, "subdir"))
+        file_quick_write(path_svn_checkout, "subdir/file2", b"hello world!\n")
+
+        # older clients expect (name, name_rel, type)
+        d = self.directory_list()
+        self.assertEqual([["file1", "file1", "file"], ["subdir", "subdir", "dir"]], d["items_list"])
+
+        d = self.directory_list(details=1, recursive=1)
+        self.assertEqual(["file1", "subdir", "subdir/file2"], [item[1] for item in d["items_list"]])
+        self.assertEqual(
+                [os.path.getsize(os.path.join(path_svn_checkout, "file1")), 0, 13],
+                [item[3] for item in d["items_list"]])
+
+    def test_directory_list_page(self):
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        for i in range(10):
+            file_quick_write(path_svn_checkout, "file_%d" % i, b"data\n")
+        d = self.directory_list()
+        items_list = d["items_list"]
+        self.assertEqual(11, len(items_list))
+
+        items_page = []
+        while len(items_page) < d["items_total"]:
+            d = self.directory_list(offset=len(items_page), limit=3)
+            self.assertEqual(11, d["items_total"])
+            items_page.extend(d["items_list"])
+        self.assertEqual(items_list, items_page)
+
+    def test_directory_list_etag(self):
+        res = self.open_with_auth('/{0}/file_list'.format(PROJECT_NAME), 'GET', data=dict(path=''))
+        etag = res.headers["ETag"]
+        res = self.app.get(
+                '/{0}/file_list?path='.format(PROJECT_NAME),
+                headers={
+                    'Authorization': 'Basic ' + b64encode(b"username:").decode('ascii'),
+                    'If-None-Match': etag,
+                    })
+        self.assertEqual(res.status_code, 304)
+
     def test_file_info(self):
         res = self.open_with_auth('/{0}/file'.format(PROJECT_NAME), 
             'GET', 
@@ -196,6 +252,78 @@ class ServerUsageTest(ServerTestCase):
         # print(f['size'])
 
 
+    def test_file_info_batch(self):
+        data = dict(
+                filepath='file1', command='info',
+                arguments=json.dumps({"filepaths": ["file1", "missing"]}))
+        res = self.open_with_auth('/{0}/file'.format(PROJECT_NAME), 'GET', data=data)
+        self.assertEqual(res.status_code, 200)
+        files = json.loads(res.data.decode('utf-8'))["files"]
+
+        self.assertEqual(["file1", "missing"], sorted(files.keys()))
+        self.assertEqual(21, files["file1"]["size"])
+        self.assertEqual(1, len(files["file1"]["log"]))
+        self.assertIsNone(files["missing"]["size"])
+        self.assertEqual([], files["missing"]["log"])
+
+        # a single file
+        res = self.open_with_auth('/{0}/file'.format(PROJECT_NAME), 'GET', data=dict(filepath='file1', command='info'))
+        f = json.loads(res.data.decode('utf-8'))
+        self.assertEqual(files["file1"], f)
+
+    def test_svn_log(self):
+        # the log is read once, then updated with new revisions.
+        from application.modules.resources import svn_log
+
+        def log_xml(*revisions):
+            return (
+                '<?xml version="1.0" encoding="UTF-8"?><log>' +
+                "".join(
+                    '<logentry revision="%d"><author>my_user</author>'
+                    '<date>2015-02-02T12:00:00.000000Z</date>'
+                    '<paths>%s</paths><msg>Commit %d</msg></logentry>' % (
+                        revision,
+                        "".join('<path action="M" kind="file">/trunk/%s</path>' % f for f in filepaths),
+                        revision)
+                    for revision, filepaths in revisions) +
+                '</log>')
+
+        local_client = mock.Mock()
+        local_client.info.return_value = {"url": "file:///repo/trunk", "repository_root": "file:///repo"}
+        commands = []
+        # {command: output}
+        results = {}
+
+        def run_command(command, args, combine=False):
+            commands.append((command, args))
+            return results[command]
+        local_client.run_command.side_effect = run_command
+
+        repository_log = svn_log.RepositoryLog("/repo")
+
+        results["info"] = '<info><entry revision="2"></entry></info>'
+        results["log"] = log_xml((1, ["a", "b"]), (2, ["a", "other/c"]))
+        log = repository_log.log(local_client, ["a", "b", "./other/c", "missing"])
+        self.assertEqual([2, 1], [e.revision for e in log["a"]])
+        self.assertEqual([1], [e.revision for e in log["b"]])
+        self.assertEqual(["Commit 2"], [e.msg for e in log["./other/c"]])
+        self.assertEqual([], log["missing"])
+        self.assertEqual(['-r', '1:2'], commands[-1][1][2:4])
+
+        # no new revisions, only the head revision is checked
+        del commands[:]
+        log = repository_log.log(local_client, ["a"], limit=1)
+        self.assertEqual([2], [e.revision for e in log["a"]])
+        self.assertEqual(["info"], [command for command, args in commands])
+
+        # only new revisions are read
+        results["info"] = '<info><entry revision="3"></entry></info>'
+        results["log"] = log_xml((3, ["b"]))
+        log = repository_log.log(local_client, ["a", "b"])
+        self.assertEqual([2, 1], [e.revision for e in log["a"]])
+        self.assertEqual([3, 1], [e.revision for e in log["b"]])
+        self.assertEqual(['-r', '3:3'], commands[-1][1][2:4])
+
     def test_file_bundle(self):
         res = self.open_with_auth('/{0}/file'.format(PROJECT_NAME), 
             'GET', 
@@ -203,7 +331,7 @@ class ServerUsageTest(ServerTestCase):
 
         assert res.status_code == 200
         f = json.loads(res.data.decode('utf-8'))
-        assert f['status'] == 'building'
+        assert f['status'] == 'waiting'
 
         # Not ideal, but we have to wait for the server to build the bundle
         # and this happens in the background.
@@ -218,6 +346,284 @@ class ServerUsageTest(ServerTestCase):
 
         #input()
 
+    def bundle_request(self, filepath, command='bundle', priority=None):
+        data = dict(filepath=filepath, command=command)
+        if priority is not None:
+            data['arguments'] = json.dumps({"priority": priority})
+        res = self.open_with_auth('/{0}/file'.format(PROJECT_NAME), 'GET', data=data)
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data.decode('utf-8'))
+
+    def bundle_get(self, filepath):
+        db.session.expire_all()
+        return Bundle.query.filter_by(
+                source_file_path=os.path.join(self.path_remote_store, "svn_checkout", filepath)).one()
+
+    def test_file_bundle_stale(self):
+        # bundles are built again when the files they contain change.
+        from application.modules.resources.queue import bundle_fingerprint
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        filepath = os.path.join(path_svn_checkout, "file1")
+        filepath_zip = os.path.join(TMP_DIR, "bundle.zip")
+        file_quick_write(filepath_zip, data=b"zip")
+
+        project = Project.query.filter_by(name=PROJECT_NAME).one()
+        b = Bundle(
+                project_id=project.id,
+                source_file_path=filepath,
+                bundle_path=filepath_zip,
+                status="available",
+                fingerprint=json.dumps(bundle_fingerprint(path_svn_checkout, [filepath])),
+                )
+        db.session.add(b)
+        db.session.commit()
+
+        with mock.patch.object(bundle_queue, '_update'):
+            f = self.bundle_request('file1')
+            self.assertEqual(f['status'], 'available')
+            self.assertEqual(f['filepath'], filepath_zip)
+
+            file_quick_write(filepath, data=b"hello world!\n")
+            f = self.bundle_request('file1')
+            self.assertEqual(f['status'], 'waiting')
+        self.assertEqual(self.bundle_get('file1').status, 'waiting')
+
+    def test_bundle_is_stale(self):
+        import time
+        from application.modules.resources.queue import bundle_fingerprint
+        from application.modules.resources.queue import bundle_is_stale
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        filepaths = [os.path.join(path_svn_checkout, f) for f in ("file1", "file2", "file3")]
+        file_quick_write(filepaths[1], data=b"data\n")
+
+        def bundle_from_fingerprint(fingerprint):
+            b = mock.Mock()
+            b.project.repository_path = path_svn_checkout
+            b.fingerprint = None if fingerprint is None else json.dumps(fingerprint)
+            return b
+
+        self.assertTrue(bundle_is_stale(bundle_from_fingerprint(None)))
+
+        fingerprint = bundle_fingerprint(path_svn_checkout, filepaths)
+        self.assertEqual(["file1", "file2", "file3"], sorted(fingerprint.keys()))
+        self.assertIsNone(fingerprint["file3"])
+        self.assertFalse(bundle_is_stale(bundle_from_fingerprint(fingerprint)))
+
+        # modified
+        file_quick_write(filepaths[1], data=b"data data\n")
+        self.assertTrue(bundle_is_stale(bundle_from_fingerprint(fingerprint)))
+
+        # missing file added
+        fingerprint = bundle_fingerprint(path_svn_checkout, filepaths)
+        file_quick_write(filepaths[2], data=b"data\n")
+        self.assertTrue(bundle_is_stale(bundle_from_fingerprint(fingerprint)))
+
+        # modified while building (the build may have read the file while being written)
+        fingerprint = bundle_fingerprint(path_svn_checkout, filepaths, time_start=time.time() - 60.0)
+        self.assertTrue(bundle_is_stale(bundle_from_fingerprint(fingerprint)))
+
+    def test_file_bundle_shared(self):
+        # requests for a bundle which is already queued share it.
+        # (the queue isn't updated, so bundles stay queued)
+        with mock.patch.object(bundle_queue, '_update'):
+            for i in range(3):
+                f = self.bundle_request('file1')
+                self.assertEqual(f['status'], 'waiting')
+        self.assertEqual(Bundle.query.count(), 1)
+
+    def test_file_bundle_priority(self):
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        file_quick_write(path_svn_checkout, "file2", b"hello world!\n")
+
+        with mock.patch.object(bundle_queue, '_update'):
+            self.bundle_request('file1', priority=0)
+            self.bundle_request('file2', priority=5)
+            # requesting a queued bundle raises its priority, but never lowers it.
+            self.bundle_request('file1', priority=10)
+            self.bundle_request('file1', priority=1)
+        self.assertEqual(self.bundle_get('file1').priority, 10)
+        self.assertEqual(self.bundle_get('file2').priority, 5)
+
+        # a single worker builds the highest priority bundle first
+        queue = BundleQueue()
+        with mock.patch.dict(app.config, {"BUNDLE_WORKERS": 1}), \
+                mock.patch('application.modules.resources.queue.multiprocessing.Process') as process, \
+                app.app_context():
+            process.return_value.is_alive.return_value = True
+            queue._update()
+        for p, filepath_zip in queue._running.values():
+            os.remove(filepath_zip)
+
+        self.assertEqual(process.call_count, 1)
+        self.assertEqual(self.bundle_get('file1').status, 'building')
+        self.assertEqual(self.bundle_get('file2').status, 'waiting')
+
+    def test_file_bundle_cancel(self):
+        with mock.patch.object(bundle_queue, '_update'):
+            f = self.bundle_request('file1')
+            self.assertEqual(f['status'], 'waiting')
+            f = self.bundle_request('file1', command='bundle_cancel')
+            self.assertEqual(f['status'], 'cancelled')
+            self.assertEqual(self.bundle_get('file1').status, 'cancelled')
+
+            # no longer queued
+            f = self.bundle_request('file1', command='bundle_cancel')
+            self.assertNotIn('status', f)
+
+            # requesting the bundle again queues it again
+            f = self.bundle_request('file1')
+            self.assertEqual(f['status'], 'waiting')
+            self.assertEqual(self.bundle_get('file1').status, 'waiting')
+
+
+    def commit_upload_chunk(self, upload_id, offset, chunk, truncate=False):
+        import io
+        import hashlib
+        res = self.app.put(
+                '/{0}/file'.format(PROJECT_NAME),
+                query_string={
+                    "command": "commit_upload",
+                    "arguments": json.dumps({
+                        "upload_id": upload_id,
+                        "offset": offset,
+                        "checksum": hashlib.sha1(chunk).hexdigest(),
+                        "truncate": truncate,
+                        }),
+                    },
+                headers={'Authorization': 'Basic ' + b64encode(b"username:").decode('ascii')},
+                data={"file": (io.BytesIO(chunk), "file")},
+                )
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data.decode('utf-8'))["offset"]
+
+    def commit_request(self, upload_id):
+        res = self.app.put(
+                '/{0}/file'.format(PROJECT_NAME),
+                query_string={
+                    "command": "commit",
+                    "arguments": json.dumps({"message": "Commit", "upload_id": upload_id}),
+                    },
+                headers={'Authorization': 'Basic ' + b64encode(b"username:").decode('ascii')},
+                )
+        return res.status_code, json.loads(res.data.decode('utf-8'))
+
+    def test_commit_upload(self):
+        from bam.utils.system import uuid_from_file
+        project, filepath_upload = self.commit_upload_write({"file2": b"new file\n" * 100}, {})
+        data = file_quick_read(filepath_upload)
+        upload_id = uuid_from_file(filepath_upload)
+        os.remove(filepath_upload)
+        filepath_upload = os.path.join(project.upload_path, upload_id + ".zip")
+
+        self.assertEqual(100, self.commit_upload_chunk(upload_id, 0, data[:100]))
+        # the same chunk again isn't written twice
+        self.assertEqual(100, self.commit_upload_chunk(upload_id, 0, data[:100]))
+        self.assertEqual(100, self.commit_upload_chunk(upload_id, 50, data[50:100]))
+        self.assertEqual(len(data), self.commit_upload_chunk(upload_id, 100, data[100:]))
+        self.assertEqual(data, file_quick_read(filepath_upload))
+
+        # start again
+        self.assertEqual(100, self.commit_upload_chunk(upload_id, 0, data[:100], truncate=True))
+        self.assertEqual(data[:100], file_quick_read(filepath_upload))
+
+        # an upload which doesn't match its id is removed
+        with mock.patch("application.modules.resources.commit_queue"):
+            status_code, d = self.commit_request(upload_id)
+        self.assertEqual(400, status_code)
+        self.assertFalse(os.path.exists(filepath_upload))
+
+        self.assertEqual(len(data), self.commit_upload_chunk(upload_id, 0, data))
+        with mock.patch("application.modules.resources.commit_queue") as commit_queue:
+            status_code, d = self.commit_request(upload_id)
+        self.assertEqual(200, status_code)
+        self.assertEqual("waiting", d["status"])
+        self.assertEqual(1, commit_queue.notify.call_count)
+        self.assertEqual(filepath_upload, Commit.query.get(d["commit_id"]).upload_path)
+
+    def commit_upload_write(self, files, paths_ops):
+        """
+        Write an upload as 'bam commit' does, 'files' is {path: data, ...}.
+        """
+        import zipfile
+        project = Project.query.filter_by(name=PROJECT_NAME).one()
+        os.makedirs(project.upload_path, exist_ok=True)
+        filepath_upload = os.path.join(project.upload_path, "upload.zip")
+        with zipfile.ZipFile(filepath_upload, 'w') as zip_handle:
+            for f, data in files.items():
+                zip_handle.writestr(f, data)
+            zip_handle.writestr(".bam_paths_remap.json", json.dumps({f: f for f in files}))
+            zip_handle.writestr(".bam_paths_ops.json", json.dumps(paths_ops))
+        return project, filepath_upload
+
+    def test_commit_apply_again(self):
+        # a commit is applied again when the server stops before it's 'done'.
+        from application.modules.resources import FileAPI
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        project, filepath_upload = self.commit_upload_write({"file2": b"new file\n"}, {"file1": "D"})
+
+        with app.app_context():
+            for i in range(2):
+                FileAPI.commit_apply(project, filepath_upload, "Commit", "my_user")
+                self.assertFalse(os.path.exists(os.path.join(path_svn_checkout, "file1")))
+                self.assertEqual(b"new file\n", file_quick_read(path_svn_checkout, "file2"))
+
+        # the queue removes the upload
+        self.assertTrue(os.path.exists(filepath_upload))
+
+    def test_commit_apply_outside(self):
+        # paths outside the repository fail, the repository is left unchanged.
+        from application.modules.resources import FileAPI
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        file_quick_write(self.path_remote_store, "outside", b"outside\n")
+
+        for paths_ops in ({"../outside": "D"}, {"": "D"}):
+            project, filepath_upload = self.commit_upload_write({"file2": b"new file\n"}, paths_ops)
+            with app.app_context():
+                with self.assertRaises(ValueError):
+                    FileAPI.commit_apply(project, filepath_upload, "Commit", "my_user")
+
+            self.assertTrue(os.path.exists(os.path.join(self.path_remote_store, "outside")))
+            self.assertTrue(os.path.exists(os.path.join(path_svn_checkout, "file1")))
+            self.assertFalse(os.path.exists(os.path.join(path_svn_checkout, "file2")))
+
+    def test_svn_command_targets(self):
+        # many paths (some with spaces) in a single svn command
+        from application.modules.resources import FileAPI
+        import svn.local
+        path_svn_checkout = os.path.join(self.path_remote_store, "svn_checkout")
+        paths = []
+        for i in range(100):
+            paths.append(os.path.join(path_svn_checkout, "dir %d" % (i % 10), "file %d" % i))
+            os.makedirs(os.path.dirname(paths[-1]), exist_ok=True)
+            file_quick_write(paths[-1], data=b"data\n")
+
+        local_client = svn.local.LocalClient(path_svn_checkout)
+        FileAPI.svn_command_targets(local_client, 'add', ['--force', '--parents'], paths, TMP_DIR)
+        status = local_client.run_command('status', [path_svn_checkout], combine=True)
+        for f in paths:
+            self.assertIn("A       " + f, status)
+        # the targets file is removed
+        self.assertEqual([], [f for f in os.listdir(TMP_DIR) if f.startswith(".bam_svn_targets_")])
+
+    def test_commit_claim(self):
+        # only one commit per project runs at once
+        project, filepath_upload = self.commit_upload_write({"file2": b"new file\n"}, {})
+        commit_ids = []
+        for i in range(2):
+            c = Commit(project_id=project.id, upload_path=filepath_upload, user="my_user",
+                       message="Commit %d" % i, status="waiting")
+            db.session.add(c)
+            db.session.commit()
+            commit_ids.append(c.id)
+
+        with app.app_context():
+            self.assertTrue(CommitQueue._commit_claim(commit_ids[0], project.id))
+            self.assertFalse(CommitQueue._commit_claim(commit_ids[1], project.id))
+            # claimed already
+            self.assertFalse(CommitQueue._commit_claim(commit_ids[0], project.id))
+
+        db.session.expire_all()
+        self.assertEqual(["running", "waiting"], [Commit.query.get(i).status for i in commit_ids])
 
 
 if __name__ == '__main__':
@@ -63,6 +63,8 @@ try:
 except ImportError:
     app.config["ALLOWED_EXTENSIONS"] = {'txt', 'mp4', 'png', 'jpg', 'jpeg', 'gif', 'blend', 'zip'}
     app.config["STORAGE_BUNDLES"] = "/tmp/bam_storage_bundles"
+    app.config["BUNDLE_WORKERS"] = 2
+    app.config["UPLOAD_EXPIRE"] = 60 * 60 * 24 * 7
 
 
 db = SQLAlchemy(app)
@@ -70,6 +72,8 @@ log = logging.getLogger("webservice")
 
 from application.modules.resources import DirectoryAPI
 from application.modules.resources import FileAPI
+from application.modules.resources.queue import bundle_queue
+from application.modules.resources.queue import commit_queue
 
 if os.environ.get("BAM_VERBOSE"):
     logging.basicConfig(level=logging.DEBUG)
@@ -94,3 +98,11 @@ def unauthorized():
 
 api.add_resource(DirectoryAPI, '/<project_name>/file_list', endpoint='file_list')
 api.add_resource(FileAPI, '/<project_name>/file', endpoint='file')
+
+
+@app.before_first_request
+def queue_start():
+    # build bundles & apply commits which were queued before the server stopped,
+    # started by each server process (not on import, see 'DatabaseQueue.start').
+    bundle_queue.start()
+    commit_queue.start()
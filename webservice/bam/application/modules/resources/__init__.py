@@ -1,10 +1,12 @@
 import os
 import json
+import time
+import threading
 import svn.local
 import werkzeug
-import xml.etree.ElementTree
 import logging
-from multiprocessing import Process
+import datetime
+import sqlalchemy.exc
 
 from flask import Flask
 from flask import jsonify
@@ -31,13 +33,35 @@ from application.modules.projects import admin
 from application.modules.projects.model import Project
 from application.modules.projects.model import ProjectSetting
 from application.modules.resources.model import Bundle
+from application.modules.resources.model import Commit
+from application.modules.resources.queue import bundle_queue
+from application.modules.resources.queue import commit_queue
+from application.modules.resources.queue import bundle_is_stale
+from application.modules.resources.stream import message_encode_iter
+from application.modules.resources import svn_log
 
 
 class DirectoryAPI(Resource):
-    """Displays list of files."""
+    """Displays list of files.
+
+    Optional arguments:
+    - recursive: list all files below 'path'.
+    - offset, limit: return a page of the (sorted) list.
+    - details: items include their size & mtime,
+      (name, name_rel, type, size, mtime) instead of (name, name_rel, type).
+
+    Listings are cached for a short time (FILE_LIST_CACHE_TTL seconds),
+    the ETag of the response is for the entire listing,
+    so clients can check their own copy is valid using If-None-Match.
+    """
 
     decorators = [auth.login_required]
 
+    # {(path_abs, recursive, details): (time, items_list, etag), ...}
+    _cache = {}
+    _cache_lock = threading.Lock()
+    _cache_size_max = 64
+
     def __init__(self):
         parser = reqparse.RequestParser()
         # parser.add_argument('rate', type=int, help='Rate cannot be converted')
@@ -52,6 +76,9 @@ class DirectoryAPI(Resource):
         path = request.args['path']
         if not path:
             path = ''
+        recursive = request.args.get('recursive', '0') not in {'0', 'false', ''}
+        # older clients only support (name, name_rel, type) items.
+        details = request.args.get('details', '0') not in {'0', 'false', ''}
 
         path_root_abs = project.repository_path
         parent_path = ''
@@ -63,30 +90,100 @@ class DirectoryAPI(Resource):
         if not os.path.isdir(path_root_abs):
             return jsonify(message="Path is not a directory %r" % path_root_abs)
 
-        items_list = []
-
-        for f in os.listdir(path_root_abs):
+        items_list, etag = self.listing(path_root_abs, path, recursive, details)
 
-            # ignore svn internal paths
-            if f == ".svn":
-                continue
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+            response.set_etag(etag)
+            return response
 
-            f_rel = os.path.join(path, f)
-            f_abs = os.path.join(path_root_abs, f)
-
-            if os.path.isdir(f_abs):
-                items_list.append((f, f_rel, "dir"))
-            else:
-                items_list.append((f, f_rel, "file"))
+        items_total = len(items_list)
+        offset = max(0, request.args.get('offset', 0, type=int))
+        limit = request.args.get('limit', None, type=int)
+        if limit is not None:
+            items_list = items_list[offset:offset + max(0, limit)]
+        elif offset:
+            items_list = items_list[offset:]
 
         project_files = {
             "parent_path": parent_path,
             "items_list": items_list,
+            "items_total": items_total,
             }
 
-        return jsonify(project_files)
+        response = jsonify(project_files)
+        response.set_etag(etag)
+        return response
         # return {'message': 'Display files list'}
 
+    @classmethod
+    def listing(cls, path_root_abs, path, recursive, details):
+        """
+        Return the (cached) sorted items list and its ETag.
+        """
+        time_now = time.time()
+        key = (path_root_abs, recursive, details)
+        with cls._cache_lock:
+            item = cls._cache.get(key)
+        if item is not None and (time_now - item[0]) < app.config.get("FILE_LIST_CACHE_TTL", 5.0):
+            return item[1], item[2]
+
+        items_list = []
+        cls.listing_scan(path_root_abs, path, recursive, details, items_list)
+        items_list.sort(key=lambda item: item[1])
+
+        import hashlib
+        etag = hashlib.sha1(json.dumps(items_list).encode('utf-8')).hexdigest()
+
+        with cls._cache_lock:
+            cls._cache.pop(key, None)
+            # drop the oldest
+            while len(cls._cache) >= cls._cache_size_max:
+                del cls._cache[next(iter(cls._cache))]
+            cls._cache[key] = (time_now, items_list, etag)
+
+        return items_list, etag
+
+    @classmethod
+    def listing_cache_clear(cls):
+        with cls._cache_lock:
+            cls._cache.clear()
+
+    @staticmethod
+    def listing_scan(path_root_abs, path, recursive, details, items_list):
+        """
+        Add (name, name_rel, type) for each item to 'items_list',
+        (name, name_rel, type, size, mtime) when 'details' is set.
+        """
+        dirs = [(path_root_abs, path)]
+        while dirs:
+            dir_abs, dir_rel = dirs.pop()
+            with os.scandir(dir_abs) as it:
+                for entry in it:
+                    f = entry.name
+
+                    # ignore svn internal paths
+                    if f == ".svn":
+                        continue
+
+                    f_rel = os.path.join(dir_rel, f)
+                    try:
+                        is_dir = entry.is_dir()
+                        st = entry.stat() if details else None
+                    except FileNotFoundError:
+                        # removed while listing
+                        continue
+
+                    if is_dir and recursive and not entry.is_symlink():
+                        dirs.append((entry.path, f_rel))
+
+                    if not details:
+                        items_list.append((f, f_rel, "dir" if is_dir else "file"))
+                    elif is_dir:
+                        items_list.append((f, f_rel, "dir", 0, st.st_mtime))
+                    else:
+                        items_list.append((f, f_rel, "file", st.st_size, st.st_mtime))
+
 
 class FileAPI(Resource):
     """Gives acces to a file. Currently requires 2 arguments:
@@ -117,34 +214,48 @@ class FileAPI(Resource):
 
     def get(self, project_name):
         command = request.args['command']
-        command_args = request.args.get('arguments')
+        # 'values' so large arguments may be passed in the request body (see 'post')
+        command_args = request.values.get('arguments')
         if command_args is not None:
             command_args = json.loads(command_args)
 
         project = Project.query.filter_by(name=project_name).first()
 
         if command == 'info':
-            filepath = request.args['filepath']
+            # optionally pass many files at once,
+            # returns {"files": {filepath: info, ...}}
+            filepaths = (command_args or {}).get('filepaths')
+            if filepaths is None:
+                filepaths = [request.args['filepath']]
 
             r = svn.local.LocalClient(project.repository_path)
-            svn_log = r.log_default(None, None, 5, filepath)
-            svn_log = [l for l in svn_log]
-
-            size = os.path.getsize(os.path.join(r.path, filepath))
+            svn_logs = svn_log.log_files(r, filepaths, limit=5)
 
             # Check bundle_status: (ready, in_progress)
-            full_filepath = os.path.join(project.repository_path, filepath)
-            b = Bundle.query.filter_by(source_file_path=full_filepath).first()
-            if b:
+            full_filepaths = {os.path.join(project.repository_path, f): f for f in filepaths}
+            bundles = {}
+            for b in Bundle.query.filter(Bundle.source_file_path.in_(list(full_filepaths.keys()))):
                 bundle_status = b.status
-            else:
-                bundle_status = None
+                if bundle_status == "available" and bundle_is_stale(b):
+                    bundle_status = "stale"
+                bundles[full_filepaths[b.source_file_path]] = bundle_status
+
+            files = {}
+            for full_filepath, filepath in full_filepaths.items():
+                try:
+                    size = os.path.getsize(full_filepath)
+                except FileNotFoundError:
+                    size = None
+                files[filepath] = dict(
+                        filepath=filepath,
+                        log=svn_logs[filepath],
+                        size=size,
+                        bundle_status=bundles.get(filepath),
+                        )
 
-            return jsonify(
-                filepath=filepath,
-                log=svn_log,
-                size=size,
-                bundle_status=bundle_status)
+            if command_args is not None and 'filepaths' in command_args:
+                return jsonify(files=files)
+            return jsonify(files[filepaths[0]])
 
         elif command == 'bundle':
             filepath = request.args['filepath']
@@ -156,68 +267,61 @@ class FileAPI(Resource):
             elif os.path.isdir(filepath):
                 return jsonify(message="Path is a directory %r" % filepath)
 
-            def bundle():
-                def report(txt):
-                    pass
-
-                # pack the file!
-                import tempfile
-
-                # weak! (ignore original opened file)
-                filepath_zip = tempfile.mkstemp(dir=app.config['STORAGE_BUNDLES'], suffix=".zip")
-                os.close(filepath_zip[0])
-                filepath_zip = filepath_zip[1]
-
-                # subprocess here
-                for r in self.pack_fn(
-                        filepath, filepath_zip,
-                        project.repository_path,
-                        True,
-                        report,
-                        'ZIP',
-                        ):
-                    pass
-
-                b = Bundle.query.filter_by(source_file_path=filepath).first()
-                if b:
-                    b.bundle_path = filepath_zip
-                else:
-                    b = Bundle(
-                        source_file_path=filepath,
-                        bundle_path=filepath_zip)
-                    db.session.add(b)
-                b.status = "available"
-                db.session.commit()
-                # once done, we update the queue, as well as the status of the
-                # bundle in the table and serve the bundle_path
-                # return jsonify(filepath=filepath_zip)
-
+            priority = (command_args or {}).get('priority', 0)
 
             # Check in database if file has been requested already
             b = Bundle.query.filter_by(source_file_path=filepath).first()
             if b:
                 if b.status == "available":
                     # Check if archive is available on the filesystem
-                    if os.path.isfile(b.bundle_path):
+                    # and none of the files it contains have changed.
+                    if os.path.isfile(b.bundle_path) and not bundle_is_stale(b):
                         # serve the local path for the zip file
                         return jsonify(filepath=b.bundle_path, status="available")
-                    else:
-                        b.status = "building"
+                elif b.status in {"waiting", "building"}:
+                    # we are waiting for the server to build the archive,
+                    # share the existing job (only ever raising its priority).
+                    if priority > b.priority:
+                        b.priority = priority
                         db.session.commit()
-                        # build the bundle again
-                elif b.status == "building":
-                    # we are waiting for the server to build the archive
-                    filepath=None
-                    return jsonify(filepath=filepath, status="building")
+                    filepath = None
+                    return jsonify(filepath=filepath, status=b.status)
+                # otherwise build the bundle again
+            else:
+                b = Bundle(
+                    project_id=project.id,
+                    source_file_path=filepath)
+                db.session.add(b)
 
-            # If file not avaliable, start the bundling and return a None filepath,
+            # If file not avaliable, queue the bundling and return a None filepath,
             # which the cloud will interpret as, no file is available at the moment
+            b.project_id = project.id
+            b.status = "waiting"
+            b.priority = priority
+            b.update_date = datetime.datetime.now()
+            try:
+                db.session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                # another request added this bundle
+                db.session.rollback()
+            bundle_queue.notify()
+
+            filepath = None
+            return jsonify(filepath=filepath, status="waiting")
+
+        elif command == 'bundle_cancel':
+            filepath = request.args['filepath']
+            filepath = os.path.join(project.repository_path, filepath)
+
+            b = Bundle.query.filter_by(source_file_path=filepath).first()
+            if b is None or b.status not in {"waiting", "building"}:
+                return jsonify(message="Bundle not queued %r" % filepath)
 
-            p = Process(target=bundle,)
-            p.start()
+            b.status = "cancelled"
+            db.session.commit()
+            bundle_queue.notify()
 
-            filepath=None
-            return jsonify(filepath=filepath, status="building")
+            return jsonify(filepath=None, status=b.status)
 
         elif command == 'checkout':
             filepath = request.args['filepath']
@@ -228,6 +332,9 @@ class FileAPI(Resource):
             elif os.path.isdir(filepath):
                 return jsonify(message="Path is a directory %r" % filepath)
 
+            # 4mb chunks
+            CHUNK_RAW = 4194304
+
             def response_message_iter():
                 ID_MESSAGE = 1
                 ID_PAYLOAD = 2
@@ -270,7 +377,7 @@ class FileAPI(Resource):
 
                     yield struct.pack('<II', ID_PAYLOAD, f_size)
                     while True:
-                        data = f.read(1024)
+                        data = f.read(CHUNK_RAW)
                         if not data:
                             break
                         yield data
@@ -281,7 +388,14 @@ class FileAPI(Resource):
             # 4mb chunks
             CHUNK_COMPRESS = 4194304
             # CHUNK_COMPRESS = 512  # for testing, we can ensure many chunks are supported
+            # 16mb chunks, for files which are sent uncompressed
+            CHUNK_RAW = 16777216
             files = command_args['files']
+            # optional, {f_rel: signature, ...} of the clients cached files
+            # so we only need to send the changes, see: 'blendfile_delta'
+            signatures = command_args.get('signatures', {})
+            # older clients don't support uncompressed payloads (ID_PAYLOAD_RAW*)
+            use_payload_raw = command_args.get('payload_raw', False)
 
             def response_message_iter():
                 ID_MESSAGE = 1
@@ -289,18 +403,42 @@ class FileAPI(Resource):
                 ID_PAYLOAD_APPEND = 3
                 ID_PAYLOAD_EMPTY = 4
                 ID_DONE = 5
+                ID_PAYLOAD_DELTA = 6
+                ID_PAYLOAD_COPY = 7
+                ID_PAYLOAD_RAW = 8
+                ID_PAYLOAD_RAW_APPEND = 9
                 import struct
+                from bam.utils.system import is_compressed_filetype
 
                 def report(txt):
-                    txt_bytes = txt.encode('utf-8')
-                    return struct.pack('<II', ID_MESSAGE, len(txt_bytes)) + txt_bytes
-
-                yield b'BAM\0'
+                    return (ID_MESSAGE, txt.encode('utf-8'), False)
 
                 # pack the file!
                 for f_rel in files:
                     f_abs = os.path.join(project.repository_path, f_rel)
-                    if os.path.exists(f_abs):
+                    signature = signatures.get(f_rel)
+                    # don't spend time compressing media which is already compressed
+                    use_compress = not (use_payload_raw and is_compressed_filetype(f_abs.encode('utf-8')))
+                    if signature is not None and os.path.exists(f_abs):
+                        yield report("%s: %r\n" % ("downloading (delta)", f_rel))
+                        # only send the changes,
+                        # the client rebuilds the file from its cached copy
+                        from bam.blend import blendfile_delta
+
+                        yield (ID_PAYLOAD_DELTA, b'', False)
+                        for op in blendfile_delta.delta_from_signature(f_abs, signature):
+                            if op[0] == b'COPY':
+                                yield (ID_PAYLOAD_COPY, struct.pack('<QQ', op[1], op[2]), False)
+                            else:
+                                data_raw = op[1]
+                                if use_compress:
+                                    for i in range(0, len(data_raw), CHUNK_COMPRESS):
+                                        yield (ID_PAYLOAD_APPEND, data_raw[i:i + CHUNK_COMPRESS], True)
+                                else:
+                                    yield (ID_PAYLOAD_RAW_APPEND, data_raw, False)
+                                del data_raw
+                        del blendfile_delta
+                    elif os.path.exists(f_abs):
                         yield report("%s: %r\n" % ("downloading", f_rel))
                         # send over files
                         with open(f_abs, 'rb') as f:
@@ -308,47 +446,111 @@ class FileAPI(Resource):
                             f_size = f.tell()
                             f.seek(0, os.SEEK_SET)
 
-                            id_payload = ID_PAYLOAD
+                            if use_compress:
+                                id_payload, id_payload_append = ID_PAYLOAD, ID_PAYLOAD_APPEND
+                                chunk_size = CHUNK_COMPRESS
+                            else:
+                                id_payload, id_payload_append = ID_PAYLOAD_RAW, ID_PAYLOAD_RAW_APPEND
+                                chunk_size = CHUNK_RAW
+
+                            if f_size == 0:
+                                yield (id_payload, b'', use_compress)
 
                             f_size_left = f_size
-                            import lzma
                             while f_size_left:
-                                data_raw = f.read(CHUNK_COMPRESS)
+                                data_raw = f.read(chunk_size)
                                 f_size_left -= len(data_raw)
-                                data_lzma = lzma.compress(data_raw)
-                                del data_raw
                                 assert(f_size_left >= 0)
 
-                                yield struct.pack('<II', id_payload, len(data_lzma))
-                                yield data_lzma
-                                id_payload = ID_PAYLOAD_APPEND
+                                yield (id_payload, data_raw, use_compress)
+                                del data_raw
+                                id_payload = id_payload_append
                     else:
                         yield report("%s: %r\n" % ("source missing", f_rel))
-                        yield struct.pack('<II', ID_PAYLOAD_EMPTY, 0)
+                        yield (ID_PAYLOAD_EMPTY, b'', False)
 
+                yield (ID_DONE, b'', False)
 
-                yield struct.pack('<II', ID_DONE, 0)
+            def response_iter():
+                yield b'BAM\0'
+                # compress in the background, while sending
+                yield from message_encode_iter(response_message_iter())
 
-            return Response(response_message_iter(), direct_passthrough=True)
+            return Response(response_iter(), direct_passthrough=True)
+
+        elif command == 'commit_upload_status':
+            # so the client can resume an upload
+            filepath_upload = self.upload_filepath(project, command_args['upload_id'])
+            if filepath_upload is None:
+                return make_response(jsonify(message="Invalid upload id"), 400)
+            offset = os.path.getsize(filepath_upload) if os.path.exists(filepath_upload) else 0
+            return jsonify(offset=offset)
+
+        elif command == 'commit_status':
+            c = Commit.query.filter_by(id=command_args['commit_id'], project_id=project.id).first()
+            if c is None:
+                return make_response(jsonify(message="Commit not found %r" % command_args['commit_id']), 404)
+            return jsonify(commit_id=c.id, status=c.status, message=c.result)
 
         else:
             return jsonify(message="Command unknown")
 
+    def post(self, project_name):
+        # Same as 'get', used when the arguments are too big to pass in the URL,
+        # (block signatures for 'checkout_download' for eg).
+        return self.get(project_name)
+
     def put(self, project_name):
         project = Project.query.filter_by(name=project_name).first()
         command = request.args['command']
         command_args = request.args.get('arguments')
         if command_args is not None:
             command_args = json.loads(command_args)
-        file = request.files['file']
+
+        if command == 'commit_upload':
+            # Receive a single chunk of a commit (see 'bam_session.request_upload'),
+            # chunks are written directly into the upload, so there is no need
+            # to assemble the file once the last chunk arrives.
+            filepath_upload = self.upload_filepath(project, command_args['upload_id'])
+            if filepath_upload is None:
+                return make_response(jsonify(message="Invalid upload id"), 400)
+            os.makedirs(project.upload_path, exist_ok=True)
+
+            import hashlib
+            data = request.files['file'].read()
+            if hashlib.sha1(data).hexdigest() != command_args['checksum']:
+                log.debug("upload %r, checksum mismatch at %d" % (filepath_upload, command_args['offset']))
+                offset = os.path.getsize(filepath_upload) if os.path.exists(filepath_upload) else 0
+                return jsonify(offset=offset)
+
+            import fcntl
+            with open(os.open(filepath_upload, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+                # the same chunk may be sent twice at once (a proxy retrying for eg),
+                # lock so only one is written (released on closing).
+                fcntl.lockf(f, fcntl.LOCK_EX)
+                offset = f.seek(0, os.SEEK_END)
+                if command_args['offset'] == 0 and command_args.get('truncate'):
+                    # the client found the upload doesn't match its own, start again.
+                    f.truncate(0)
+                    offset = 0
+                if offset == 0:
+                    # starting a new upload, a good time to remove ones which were never finished.
+                    self.upload_cleanup(project)
+                if command_args['offset'] != offset:
+                    # out of sync (a previous request may have succeeded), let the client resume.
+                    return jsonify(offset=offset)
+
+                f.seek(offset)
+                f.write(data)
+            return jsonify(offset=offset + len(data))
+
+        upload_id = command_args.get('upload_id')
+        file = request.files.get('file')
 
         # Get the value of the first (and only) result for the specified project setting
         svn_password = next((setting.value
             for setting in project.settings
             if setting.name == 'svn_password'))
-        svn_default_user = next((setting.value
-            for setting in project.settings
-            if setting.name == 'svn_default_user'))
 
         # We get the actual username from the http headers
         svn_user = auth.username()
@@ -358,91 +560,198 @@ class FileAPI(Resource):
             return make_response(jsonify(
                 {'message': 'SVN missing password settings'}), 500)
 
-        if file and self.allowed_file(file.filename):
+        if upload_id is not None:
+            # uploaded in chunks (see 'commit_upload')
+            tmp_filepath = self.upload_filepath(project, upload_id)
+            if tmp_filepath is None or not os.path.exists(tmp_filepath):
+                return make_response(jsonify(message="Upload not found %r" % upload_id), 400)
+            # the id is the hash of the upload
+            from bam.utils.system import uuid_from_file
+            if uuid_from_file(tmp_filepath) != upload_id:
+                # remove it, so committing again uploads it again
+                os.remove(tmp_filepath)
+                return make_response(jsonify(message="Upload doesn't match its id %r" % upload_id), 400)
+        elif file and self.allowed_file(file.filename):
             os.makedirs(project.upload_path, exist_ok=True)
-
-            local_client = svn.local.LocalClient(project.repository_path)
-            # TODO, add the merge operation to a queue. Later on, the request could stop here
-            # and all the next steps could be done in another loop, or triggered again via
-            # another request
-            filename = werkzeug.secure_filename(file.filename)
-            tmp_filepath = os.path.join(project.upload_path, filename)
+            import tempfile
+            # unique name, other commits may be waiting
+            tmp_filepath = tempfile.mkstemp(dir=project.upload_path, suffix=".zip")
+            os.close(tmp_filepath[0])
+            tmp_filepath = tmp_filepath[1]
             file.save(tmp_filepath)
+        else:
+            tmp_filepath = None
+
+        if tmp_filepath is not None:
+            # The commit is applied in the background (see 'commit_apply'),
+            # commits to the same project run one at a time, in the order they're received.
+            # The client polls 'commit_status' until it's done.
+            c = Commit(
+                    project_id=project.id,
+                    upload_path=tmp_filepath,
+                    user=svn_user,
+                    message=command_args['message'],
+                    status="waiting")
+            db.session.add(c)
+            db.session.commit()
+            commit_queue.notify()
+
+            return jsonify(commit_id=c.id, status=c.status, message="Commit %d queued" % c.id)
+        else:
+            return jsonify(message='File not allowed')
 
-            # TODO, once all files are uploaded, unpack and run the tasklist (copy, add, remove
-            # files on a filesystem level and subsequently as svn commands)
-            import zipfile
-
-            extract_tmp_dir = os.path.splitext(tmp_filepath)[0]
-            with open(tmp_filepath, 'rb') as zip_file:
-                zip_handle = zipfile.ZipFile(zip_file)
-                zip_handle.extractall(extract_tmp_dir)
-            del zip_file, zip_handle
-            del zipfile
+    @staticmethod
+    def commit_apply(project, tmp_filepath, message, svn_user):
+        """
+        Apply an uploaded commit to the repository & commit it,
+        returns the output of the svn commit.
 
-            with open(os.path.join(extract_tmp_dir, '.bam_paths_remap.json'), 'r') as path_remap:
-                path_remap = json.load(path_remap)
+        Runs in the commit queue (see 'queue.CommitQueue'),
+        which removes the upload once the commit is done.
+        """
+        svn_password = next((setting.value
+            for setting in project.settings
+            if setting.name == 'svn_password'))
 
-            import shutil
-            for src_file_path, dst_file_path in path_remap.items():
-                assert(os.path.exists(os.path.join(extract_tmp_dir, src_file_path)))
+        local_client = svn.local.LocalClient(project.repository_path)
 
-                src_file_path_abs = os.path.join(extract_tmp_dir, src_file_path)
-                dst_file_path_abs = os.path.join(project.repository_path, dst_file_path)
+        # Files are extracted from the upload directly into the repository,
+        # each is written next to its destination, then renamed into place.
+        # On failure the original files are restored & svn changes reverted.
+        import shutil
+        import zipfile
 
-                os.makedirs(os.path.dirname(dst_file_path_abs), exist_ok=True)
+        repository_path = os.path.normpath(project.repository_path)
+        targets_dir = os.path.dirname(tmp_filepath)
+
+        # [(dst_abs, dst_tmp), ...]
+        paths_tmp = []
+        # files moved into place: [(dst_abs, backup_or_None), ...]
+        paths_placed = []
+        # directories we created (parents first)
+        dirs_created = []
+        paths_add = []
+        paths_remove = []
+
+        def rollback():
+            paths_revert = [dst_abs for dst_abs, _ in paths_placed] + paths_remove + dirs_created
+            if paths_revert:
+                try:
+                    FileAPI.svn_command_targets(
+                            local_client, 'revert', ['--depth', 'infinity'],
+                            paths_revert, targets_dir)
+                except Exception:
+                    log.exception("Error reverting %r" % repository_path)
+
+            for dst_abs, dst_tmp in paths_tmp:
+                if os.path.exists(dst_tmp):
+                    os.remove(dst_tmp)
+            for dst_abs, backup in reversed(paths_placed):
+                if backup is not None:
+                    os.replace(backup, dst_abs)
+                elif os.path.exists(dst_abs):
+                    os.remove(dst_abs)
+            for d in reversed(dirs_created):
+                try:
+                    os.rmdir(d)
+                except OSError:
+                    pass
 
-                shutil.move(src_file_path_abs, dst_file_path_abs)
+        try:
+            with zipfile.ZipFile(tmp_filepath, 'r') as zip_handle:
+                path_remap = json.loads(zip_handle.read('.bam_paths_remap.json').decode('utf-8'))
+                path_ops = json.loads(zip_handle.read('.bam_paths_ops.json').decode('utf-8'))
+
+                for src_file_path, dst_file_path in path_remap.items():
+                    dst_file_path_abs = os.path.normpath(os.path.join(repository_path, dst_file_path))
+                    if os.path.commonpath((repository_path, dst_file_path_abs)) != repository_path:
+                        raise ValueError("Path outside the repository %r" % dst_file_path)
+
+                    dst_dir = os.path.dirname(dst_file_path_abs)
+                    dirs_new = []
+                    while not os.path.isdir(dst_dir):
+                        dirs_new.append(dst_dir)
+                        dst_dir = os.path.dirname(dst_dir)
+                    for d in reversed(dirs_new):
+                        os.mkdir(d)
+                        dirs_created.append(d)
+
+                    dst_file_path_tmp = dst_file_path_abs + "@bam"
+                    paths_tmp.append((dst_file_path_abs, dst_file_path_tmp))
+                    with zip_handle.open(src_file_path) as f_src, open(dst_file_path_tmp, 'wb') as f_dst:
+                        shutil.copyfileobj(f_src, f_dst, 1 << 20)
+
+            # all files are written, move them into place
+            for dst_file_path_abs, dst_file_path_tmp in paths_tmp:
+                backup = None
+                if os.path.exists(dst_file_path_abs):
+                    backup = dst_file_path_abs + "@bam_orig"
+                    try:
+                        os.link(dst_file_path_abs, backup)
+                    except OSError:
+                        shutil.copy2(dst_file_path_abs, backup)
+                os.replace(dst_file_path_tmp, dst_file_path_abs)
+                paths_placed.append((dst_file_path_abs, backup))
+                paths_add.append(dst_file_path_abs)
+            paths_tmp.clear()
 
             # TODO, dry run commit (using commit message)
             # Seems not easily possible with SVN, so we might just smartly use svn status
-            result = local_client.run_command('status',
-                [local_client.info()['entry_path'], '--xml'],
-                combine=True)
-
-            # We parse the svn status xml output
-            root = xml.etree.ElementTree.fromstring(result)
-
-            # Loop throught every entry reported by the svn status command
-            for e in root.iter('entry'):
-                file_path = e.attrib['path']
-                item_status = e.find('wc-status').attrib['item']
-
-                # We add each unversioned file to SVN
-                if item_status == 'unversioned':
-                    result = local_client.run_command('add',
-                        [file_path, ])
-
-            with open(os.path.join(extract_tmp_dir, '.bam_paths_ops.json'), 'r') as path_ops:
-                path_ops = json.load(path_ops)
+            #
+            # Instead of checking the status of the entire repository and adding
+            # unversioned files one at a time, add all files we've written at once:
+            # '--force' skips files which are already versioned,
+            # '--parents' adds new directories.
+            if paths_add:
+                FileAPI.svn_command_targets(
+                        local_client, 'add', ['--force', '--parents'],
+                        paths_add, targets_dir)
 
             log.debug(path_ops)
             for file_path, operation in path_ops.items():
-                # TODO(fsiddi), collect all file paths and remove after
                 if operation == 'D':
-                    file_path_abs = os.path.join(project.repository_path, file_path)
-                    assert(os.path.exists(file_path_abs))
-                    result = local_client.run_command('rm',
-                        [file_path_abs, ])
+                    file_path_abs = os.path.normpath(os.path.join(repository_path, file_path))
+                    if (file_path_abs == repository_path or
+                            os.path.commonpath((repository_path, file_path_abs)) != repository_path):
+                        raise ValueError("Path outside the repository %r" % file_path)
+                    if not os.path.exists(file_path_abs):
+                        # already removed (the commit is applied again, see 'queue.CommitQueue').
+                        continue
+                    paths_remove.append(file_path_abs)
+
+            if paths_remove:
+                FileAPI.svn_command_targets(
+                        local_client, 'rm', [],
+                        paths_remove, targets_dir)
 
             # Commit command
             result = local_client.run_command('commit',
-                [local_client.info()['entry_path'],
+                [repository_path,
                 '--no-auth-cache',
-                '--message', command_args['message'],
+                '--message', message,
                 '--username', svn_user,
                 '--password', svn_password],
                 combine=True)
+        except:
+            rollback()
+            raise
 
-            return jsonify(message=result)
-        else:
-            return jsonify(message='File not allowed')
+        for dst_file_path_abs, backup in paths_placed:
+            if backup is not None:
+                os.remove(backup)
+
+        # listings may include committed files
+        DirectoryAPI.listing_cache_clear()
+
+        return result
 
     @staticmethod
-    def pack_fn(filepath, filepath_zip, paths_remap_relbase, all_deps, report, mode):
+    def pack_fn(filepath, filepath_zip, paths_remap_relbase, all_deps, report, mode, zip_base=None):
         """
         'paths_remap_relbase' is the project path,
         we want all paths to be relative to this so we don't get server path included.
+
+        'zip_base' is an optional previous archive to reuse unchanged entries from.
         """
         import os
         from bam.blend import blendfile_pack
@@ -471,6 +780,7 @@ class FileAPI(Resource):
                         blendfile_src_dir_fakeroot=blendfile_src_dir_fakeroot.encode('utf-8'),
                         readonly=True,
                         binary_edits=binary_edits,
+                        zip_base=zip_base.encode('utf-8') if zip_base else None,
                         )
             except:
                 log.exception("Error packing the blend file")
@@ -524,6 +834,70 @@ class FileAPI(Resource):
         del binary_edits
         # done writing json!
 
+    @staticmethod
+    def svn_command_targets(local_client, command, args, paths, targets_dir):
+        """
+        Run a single svn command on many paths,
+        passed using a '--targets' file to avoid command line length limits.
+        """
+        import tempfile
+        with tempfile.NamedTemporaryFile(
+                'w', encoding='utf-8', dir=targets_dir,
+                prefix=".bam_svn_targets_", suffix=".txt", delete=False) as f:
+            for path in paths:
+                f.write(path)
+                f.write("\n")
+        try:
+            return local_client.run_command(command, args + ['--targets', f.name], combine=True)
+        finally:
+            os.remove(f.name)
+
+    @staticmethod
+    def upload_filepath(project, upload_id):
+        """
+        Return the path of a chunked upload, or None when the id is invalid.
+        """
+        import string
+        if not upload_id or not set(upload_id).issubset(string.hexdigits):
+            return None
+        return os.path.join(project.upload_path, upload_id + ".zip")
+
+    @staticmethod
+    def upload_cleanup(project):
+        """
+        Remove uploads which haven't been written to for 'UPLOAD_EXPIRE' seconds
+        (interrupted uploads the client never resumed),
+        uploads used by commits that are still queued are kept.
+        """
+        time_expire = time.time() - app.config.get("UPLOAD_EXPIRE", 60 * 60 * 24 * 7)
+        try:
+            filenames = os.listdir(project.upload_path)
+        except FileNotFoundError:
+            return
+
+        commit_paths = None
+        for filename in filenames:
+            if not filename.endswith(".zip"):
+                continue
+            filepath = os.path.join(project.upload_path, filename)
+            try:
+                if os.path.getmtime(filepath) > time_expire:
+                    continue
+            except FileNotFoundError:
+                continue
+            if commit_paths is None:
+                commit_paths = {
+                        c.upload_path for c in Commit.query.filter(
+                        Commit.project_id == project.id,
+                        Commit.status.in_(("waiting", "running")))}
+            if filepath in commit_paths:
+                continue
+            log.debug("removing expired upload %r" % filepath)
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+
     @staticmethod
     def allowed_file(filename):
         return '.' in filename and \
@@ -5,24 +5,60 @@ from application import db
 class Bundle(db.Model):
     """Bundles are the results of a 'bam bundle' command. When running such command
     for the first time we:
-        - create a task in the queue (see the queue module)
         - create a bundle entry and set its status as 'waiting'
-        - executed the task (at due time)
+          (waiting entries are the queue, see the queue module)
+        - executed the task (at due time, highest priority first)
         - set the bundle entry status to 'building'
-        - once completed we set the status to 'available'
+        - once completed we set the status to 'available' (or 'failed')
         - serve the bundle_path
 
+    Requests for a bundle which is already 'waiting' or 'building' share the same entry,
+    a 'waiting' or 'building' bundle may be 'cancelled'.
+
+    An 'available' bundle is rebuilt when its fingerprint (the size and mtime of the
+    blend file and all its dependencies) no longer matches the files in the repository.
+
     The bundle_path can be used but an application that shares access to the BAM
     storage, as well as by the 'bam checkout' command itself (later on).
 
     If this is not the case, we will provide a working download link via the 'bam info'.
     """
     id = db.Column(db.Integer, primary_key=True)
-    source_file_path = db.Column(db.String(512), nullable=False)
+    project_id = db.Column(db.Integer(), db.ForeignKey('project.id'))
+    source_file_path = db.Column(db.String(512), nullable=False, unique=True, index=True)
     bundle_path = db.Column(db.String(512))
     status = db.Column(db.String(80))
+    priority = db.Column(db.Integer(), default=0, nullable=False)
+    # JSON: {path: [size, mtime], ...} for every dependency (see the queue module)
+    fingerprint = db.Column(db.Text())
     creation_date = db.Column(db.DateTime(), default=datetime.datetime.now)
     update_date = db.Column(db.DateTime(), default=datetime.datetime.now)
 
+    project = db.relationship('Project')
+
+    def __str__(self):
+        return str(self.source_file_path)
+
+
+class Commit(db.Model):
+    """Commits are applied to the repository in the background, one at a time per project:
+        - the uploaded commit is stored with its status set as 'waiting'
+        - once the previous commits to the project are applied, the status is set to 'running'
+        - the status becomes 'done' (or 'failed'), 'result' stores the svn output
+
+    Clients poll the 'commit_status' command with the commit id.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer(), db.ForeignKey('project.id'), nullable=False)
+    upload_path = db.Column(db.String(512), nullable=False)
+    user = db.Column(db.String(255))
+    message = db.Column(db.Text())
+    status = db.Column(db.String(80), index=True)
+    result = db.Column(db.Text())
+    creation_date = db.Column(db.DateTime(), default=datetime.datetime.now)
+    update_date = db.Column(db.DateTime(), default=datetime.datetime.now)
+
+    project = db.relationship('Project')
+
     def __str__(self):
-        return str(self.name)
+        return str(self.id)
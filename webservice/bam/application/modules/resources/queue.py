@@ -0,0 +1,416 @@
+import os
+import sys
+import datetime
+import threading
+import multiprocessing
+
+from application import app
+from application import db
+from application import log
+
+from application.modules.resources.model import Bundle
+from application.modules.resources.model import Commit
+
+
+def bundle_fingerprint(repository_path, filepaths, time_start=None):
+    """
+    Return the fingerprint for a bundle's dependencies: {path: [size, mtime], ...}
+    (paths relative to the repository).
+
+    Files modified after 'time_start' may have been packed while being written,
+    these are given an mtime which never matches so the bundle is rebuilt.
+    """
+    fingerprint = {}
+    for f in filepaths:
+        try:
+            st = os.stat(f)
+        except FileNotFoundError:
+            # missing dependency, rebuild if it's added later
+            fingerprint[os.path.relpath(f, repository_path)] = None
+            continue
+        mtime = st.st_mtime
+        if time_start is not None and mtime >= time_start:
+            mtime = -1.0
+        fingerprint[os.path.relpath(f, repository_path)] = [st.st_size, mtime]
+    return fingerprint
+
+
+def bundle_is_stale(bundle):
+    """
+    Check if any of the bundle's dependencies changed since it was built
+    (bundles without a fingerprint are always stale).
+    """
+    if bundle.fingerprint is None:
+        return True
+
+    import json
+    repository_path = bundle.project.repository_path
+    for f, size_mtime in json.loads(bundle.fingerprint).items():
+        try:
+            st = os.stat(os.path.join(repository_path, f))
+        except FileNotFoundError:
+            if size_mtime is None:
+                continue
+            return True
+        if size_mtime != [st.st_size, st.st_mtime]:
+            return True
+    return False
+
+
+def bundle_build(filepath, filepath_zip, repository_path, zip_base=None):
+    """
+    Runs in a sub-process, exit status is non-zero on failure.
+
+    When rebuilding, 'zip_base' is the previous bundle,
+    only files which changed since are compressed again.
+
+    The fingerprint is written next to the zip: 'filepath_zip' + ".json"
+    """
+    import time
+    from application.modules.resources import FileAPI
+
+    def report(txt):
+        pass
+
+    time_start = time.time()
+
+    for r in FileAPI.pack_fn(
+            filepath, filepath_zip,
+            repository_path,
+            True,
+            report,
+            'ZIP',
+            zip_base=zip_base,
+            ):
+        pass
+
+    # 'pack_fn' logs errors without raising them,
+    # the paths are only written once all files are packed.
+    import zipfile
+    try:
+        with zipfile.ZipFile(filepath_zip, 'r') as zip_handle:
+            zip_handle.getinfo(".bam_paths_remap.json")
+    except (zipfile.BadZipFile, KeyError):
+        sys.exit(1)
+
+    import json
+    with zipfile.ZipFile(filepath_zip, 'r') as zip_handle:
+        paths_remap = json.loads(zip_handle.read(".bam_paths_remap.json").decode('utf-8'))
+
+    deps = {filepath}
+    if filepath.endswith(".blend"):
+        # values are relative to the repository, '.' is the bundle's own location.
+        deps.update(os.path.join(repository_path, f_src) for f_dst, f_src in paths_remap.items() if f_dst != ".")
+
+    with open(filepath_zip + ".json", 'w') as f:
+        json.dump(bundle_fingerprint(repository_path, sorted(deps), time_start), f)
+
+
+class DatabaseQueue:
+    """
+    Base class for queues stored in a database table,
+    entries with a 'waiting' status are queued, 'status_active' while being processed.
+
+    Each server process runs the queue in its own thread,
+    entries are claimed in the database so processes sharing the table never run the same entry.
+    """
+
+    # the model storing the queue
+    model = None
+    # the status of entries being processed
+    status_active = None
+    # name of the thread (for logging)
+    name = None
+
+    # seconds between checking the queue, unless notified.
+    POLL_INTERVAL = 1.0
+    # seconds between updating the 'update_date' of the entries being processed,
+    # so other server processes know they're still running.
+    HEARTBEAT_INTERVAL = 30.0
+    # seconds without a heartbeat before an entry being processed is queued again
+    # (the server process running it stopped).
+    HEARTBEAT_TIMEOUT = HEARTBEAT_INTERVAL * 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        # the process running '_thread'
+        self._pid = None
+        # entries being processed (defined by sub-classes), only accessed from '_thread'
+        self._running = {}
+        self._heartbeat_time = None
+
+    def start(self):
+        """
+        Start processing the queue in this process,
+        so entries queued before the server stopped are processed.
+
+        Call once the server process runs (not on import),
+        pre-fork servers only copy the parent process, not its threads.
+        """
+        with self._lock:
+            pid = os.getpid()
+            if self._pid != pid:
+                # forked, entries processed by the parent process aren't ours
+                self._thread = None
+                self._pid = pid
+                self._running = {}
+                self._heartbeat_time = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """
+        Call when the queue changes (entries added or cancelled).
+        """
+        self.start()
+        self._event.set()
+
+    def _run(self):
+        with app.app_context():
+            while True:
+                self._event.wait(self.POLL_INTERVAL)
+                self._event.clear()
+                try:
+                    self._update()
+                except Exception:
+                    log.exception("Error updating %s" % self.name)
+                    db.session.rollback()
+
+    def _update(self):
+        raise NotImplementedError()
+
+    def _running_ids(self):
+        """
+        Return the ids of the entries this process is running.
+        """
+        raise NotImplementedError()
+
+    def _heartbeat(self):
+        """
+        Keep the entries being processed from expiring,
+        queue entries abandoned by server processes which stopped again.
+        """
+        time_now = datetime.datetime.now()
+        if (self._heartbeat_time is not None and
+                (time_now - self._heartbeat_time).total_seconds() < self.HEARTBEAT_INTERVAL):
+            return
+        self._heartbeat_time = time_now
+
+        model = self.model
+        running_ids = self._running_ids()
+        if running_ids:
+            (model.query
+             .filter(model.id.in_(running_ids), model.status == self.status_active)
+             .update({'update_date': time_now}, synchronize_session=False))
+        # the condition on 'update_date' fails if the heartbeat is written meanwhile.
+        time_expire = time_now - datetime.timedelta(seconds=self.HEARTBEAT_TIMEOUT)
+        for entry in model.query.filter(model.status == self.status_active, model.update_date < time_expire).all():
+            if entry.id in running_ids:
+                continue
+            is_reset = (model.query
+                        .filter_by(id=entry.id, status=self.status_active, update_date=entry.update_date)
+                        .update({'status': 'waiting'}, synchronize_session=False))
+            if is_reset:
+                log.info("%s: abandoned, queued again: %s" % (self.name, entry))
+        db.session.commit()
+
+
+class BundleQueue(DatabaseQueue):
+    """
+    Build bundles in the background, using a bounded number of worker processes.
+
+    The queue itself is stored in the 'bundle' table (entries with a 'waiting' status),
+    so pending bundles are kept when the server restarts.
+    """
+
+    model = Bundle
+    status_active = 'building'
+    name = "bundle_queue"
+
+    # _running: {bundle_id: (process, filepath_zip)}
+
+    def _running_ids(self):
+        return list(self._running.keys())
+
+    def _update(self):
+        # other requests modify the bundles
+        db.session.expire_all()
+
+        # ---------------------------
+        # finished & cancelled builds
+        for bundle_id, (p, filepath_zip) in list(self._running.items()):
+            b = Bundle.query.get(bundle_id)
+            if b is None or b.status == 'cancelled':
+                log.info("Bundle cancelled: %r" % filepath_zip)
+                p.terminate()
+                p.join()
+            elif not p.is_alive():
+                p.join()
+                if p.exitcode == 0:
+                    with open(filepath_zip + ".json", 'r') as f:
+                        b.fingerprint = f.read()
+                    # replace the previous (stale) bundle
+                    filepath_zip, b.bundle_path = b.bundle_path, filepath_zip
+                    b.status = "available"
+                else:
+                    b.status = "failed"
+                b.update_date = datetime.datetime.now()
+                db.session.commit()
+            else:
+                continue
+
+            del self._running[bundle_id]
+            if filepath_zip is not None:
+                for f in (filepath_zip, filepath_zip + ".json"):
+                    if os.path.exists(f):
+                        os.remove(f)
+
+        self._heartbeat()
+
+        # ---------------
+        # start new builds
+        workers = app.config.get("BUNDLE_WORKERS", 2)
+        while len(self._running) < workers:
+            b = (Bundle.query
+                 .filter_by(status='waiting')
+                 .order_by(Bundle.priority.desc(), Bundle.update_date)
+                 .first())
+            if b is None:
+                break
+
+            # claim the bundle (other server processes may use the same table)
+            is_claimed = (Bundle.query
+                          .filter_by(id=b.id, status='waiting')
+                          .update({'status': 'building', 'update_date': datetime.datetime.now()}))
+            db.session.commit()
+            if not is_claimed:
+                continue
+
+            if b.project is None:
+                # queued before bundles stored their project
+                b.status = "failed"
+                db.session.commit()
+                continue
+
+            import tempfile
+            # weak! (ignore original opened file)
+            os.makedirs(app.config['STORAGE_BUNDLES'], exist_ok=True)
+            filepath_zip = tempfile.mkstemp(dir=app.config['STORAGE_BUNDLES'], suffix=".zip")
+            os.close(filepath_zip[0])
+            filepath_zip = filepath_zip[1]
+
+            zip_base = b.bundle_path
+            if zip_base is not None and not os.path.isfile(zip_base):
+                zip_base = None
+
+            p = multiprocessing.Process(
+                    target=bundle_build,
+                    args=(b.source_file_path, filepath_zip, b.project.repository_path, zip_base),
+                    )
+            p.start()
+            self._running[b.id] = (p, filepath_zip)
+
+
+class CommitQueue(DatabaseQueue):
+    """
+    Apply commits in the background, one at a time per project
+    (commits to a project share the same svn working copy).
+
+    The queue itself is stored in the 'commit' table (entries with a 'waiting' status),
+    so pending commits are kept when the server restarts.
+    Commits are claimed in the database, so server processes sharing the table
+    never run two commits to the same project at once.
+
+    A commit abandoned by a server process which stopped is applied again,
+    its upload is only removed once it's 'done'
+    (applying it again after the svn commit only writes the same files, committing nothing).
+    """
+
+    model = Commit
+    status_active = 'running'
+    name = "commit_queue"
+
+    # _running: {project_id: (commit_id, thread)}
+
+    def _running_ids(self):
+        return [commit_id for commit_id, t in self._running.values()]
+
+    def _update(self):
+        # other requests add commits
+        db.session.expire_all()
+
+        for project_id, (commit_id, t) in list(self._running.items()):
+            if not t.is_alive():
+                t.join()
+                del self._running[project_id]
+
+        self._heartbeat()
+
+        # the oldest waiting commit of each project which isn't busy
+        project_ids_checked = set(self._running.keys())
+        for c in Commit.query.filter_by(status='waiting').order_by(Commit.id).all():
+            if c.project_id in project_ids_checked:
+                continue
+            project_ids_checked.add(c.project_id)
+
+            if not self._commit_claim(c.id, c.project_id):
+                continue
+
+            t = threading.Thread(target=self._commit_apply, args=(c.id,), name="commit_%d" % c.id)
+            t.start()
+            self._running[c.project_id] = (c.id, t)
+
+    @staticmethod
+    def _commit_claim(commit_id, project_id):
+        """
+        Set a waiting commit to 'running', unless another commit to the project is running
+        (other server processes may use the same table).
+
+        Returns True when claimed.
+        """
+        from application.modules.projects.model import Project
+
+        # lock the project row until the commit,
+        # so no other process claims a commit to the project meanwhile.
+        Project.query.filter_by(id=project_id).with_for_update().first()
+        if Commit.query.filter_by(project_id=project_id, status='running').first() is not None:
+            db.session.commit()
+            return False
+        is_claimed = (Commit.query
+                      .filter_by(id=commit_id, status='waiting')
+                      .update({'status': 'running', 'update_date': datetime.datetime.now()},
+                              synchronize_session=False))
+        db.session.commit()
+        return bool(is_claimed)
+
+    def _commit_apply(self, commit_id):
+        from application.modules.resources import FileAPI
+
+        with app.app_context():
+            c = Commit.query.get(commit_id)
+            upload_path = c.upload_path
+            try:
+                c.result = FileAPI.commit_apply(c.project, upload_path, c.message, c.user)
+                c.status = "done"
+            except Exception as ex:
+                log.exception("Error applying commit %d" % commit_id)
+                db.session.rollback()
+                c.result = "Commit failed: %s" % str(ex)
+                c.status = "failed"
+            c.update_date = datetime.datetime.now()
+            db.session.commit()
+            if c.status == "done":
+                # only once it's 'done', so it's applied again if this process stops first.
+                if os.path.exists(upload_path):
+                    os.remove(upload_path)
+            db.session.remove()
+
+        # start the next commit to this project
+        self._event.set()
+
+
+bundle_queue = BundleQueue()
+commit_queue = CommitQueue()
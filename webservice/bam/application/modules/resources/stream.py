@@ -0,0 +1,75 @@
+"""
+Helpers for the streamed responses (see 'checkout' & 'checkout_download').
+
+Messages are ``struct.pack('<II', msg_type, size)`` followed by ``size`` bytes.
+
+Compression runs in a thread pool shared by all requests (lzma releases the GIL),
+a response only compresses a few messages ahead of what the client has read,
+so slow clients don't cause data to pile up in memory.
+"""
+
+import threading
+
+from application import app
+
+# messages encoded ahead of the client (per response)
+PREFETCH = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _executor_get():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            import os
+            import concurrent.futures
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=app.config.get("COMPRESS_WORKERS", os.cpu_count() or 1))
+        return _executor
+
+
+def message_encode(msg_type, data=b'', compress=False):
+    import struct
+    if compress:
+        import lzma
+        data = lzma.compress(data)
+    return struct.pack('<II', msg_type, len(data)) + data
+
+
+def message_encode_iter(messages, prefetch=PREFETCH):
+    """
+    Encode messages in order, compressing in the background.
+
+    :arg messages: An iterator of ``(msg_type, data, compress)`` tuples,
+       only consumed as fast as the client reads the response.
+    """
+    import struct
+    import collections
+
+    executor = _executor_get()
+    pending = collections.deque()
+    try:
+        for msg_type, data, compress in messages:
+            if compress:
+                pending.append(executor.submit(message_encode, msg_type, data, True))
+            else:
+                # avoid copying large (uncompressed) payloads into the header
+                pending.append(struct.pack('<II', msg_type, len(data)))
+                if data:
+                    pending.append(data)
+            del data
+
+            while len(pending) > prefetch:
+                msg = pending.popleft()
+                yield msg if isinstance(msg, bytes) else msg.result()
+
+        while pending:
+            msg = pending.popleft()
+            yield msg if isinstance(msg, bytes) else msg.result()
+    finally:
+        # client disconnected
+        for msg in pending:
+            if not isinstance(msg, bytes):
+                msg.cancel()
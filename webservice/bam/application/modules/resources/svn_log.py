@@ -0,0 +1,109 @@
+"""
+Cached 'svn log' for the files in a repository.
+
+Instead of running 'svn log' for each file, the log of the entire repository is read once
+(with the changed paths of each revision) and updated with new revisions as they're committed,
+so looking up the log of many files only needs to check the latest revision.
+
+Note that unlike 'svn log FILE', history from before a file was copied or moved isn't included.
+"""
+
+import threading
+import collections
+import xml.etree.ElementTree
+
+LogEntry = collections.namedtuple('LogEntry', ['date', 'msg', 'revision', 'author'])
+
+
+class RepositoryLog:
+    """
+    The log of a single working copy.
+    """
+
+    def __init__(self, repository_path):
+        self.repository_path = repository_path
+        self.lock = threading.Lock()
+        # the last revision we read
+        self.revision = 0
+        # the url of the working copy & it's path within the repository
+        self.url = None
+        self.url_prefix = None
+        # {revision: LogEntry}
+        self.entries = {}
+        # {path: [revision, ...]} (oldest first)
+        self.path_revisions = {}
+
+    def _update(self, local_client):
+        if self.url is None:
+            info = local_client.info()
+            self.url = info['url']
+            # log paths aren't url encoded
+            import urllib.parse
+            self.url_prefix = urllib.parse.unquote(
+                    self.url[len(info['repository_root']):]).rstrip('/') + '/'
+
+        result = local_client.run_command(
+                'info',
+                ['--xml', '-r', 'HEAD', self.url],
+                combine=True)
+        revision_head = int(xml.etree.ElementTree.fromstring(result).find('entry').attrib['revision'])
+        if revision_head <= self.revision:
+            return
+
+        result = local_client.run_command(
+                'log',
+                ['--xml', '-v', '-r', '%d:%d' % (self.revision + 1, revision_head), self.url],
+                combine=True)
+
+        import dateutil.parser
+        root = xml.etree.ElementTree.fromstring(result)
+        for e in root.iter('logentry'):
+            revision = int(e.attrib['revision'])
+            self.entries[revision] = LogEntry(
+                    date=dateutil.parser.parse(e.findtext('date')),
+                    msg=e.findtext('msg'),
+                    revision=revision,
+                    author=e.findtext('author'),
+                    )
+            for p in e.iter('path'):
+                # only paths within the working copy
+                path = p.text
+                if path.startswith(self.url_prefix):
+                    self.path_revisions.setdefault(path[len(self.url_prefix):], []).append(revision)
+
+        self.revision = revision_head
+
+    def log(self, local_client, filepaths, limit=None):
+        """
+        Return {filepath: [LogEntry, ...], ...} (newest first),
+        filepaths are relative to the working copy.
+        """
+        with self.lock:
+            self._update(local_client)
+
+            result = {}
+            import posixpath
+            for filepath in filepaths:
+                revisions = self.path_revisions.get(posixpath.normpath(filepath).lstrip('/'), ())
+                revisions = revisions[::-1]
+                if limit is not None:
+                    revisions = revisions[:limit]
+                result[filepath] = [self.entries[r] for r in revisions]
+            return result
+
+
+# {repository_path: RepositoryLog}
+_repository_logs = {}
+_repository_logs_lock = threading.Lock()
+
+
+def log_files(local_client, filepaths, limit=None):
+    """
+    Return the log for files in the working copy of 'local_client'.
+    """
+    repository_path = local_client.path
+    with _repository_logs_lock:
+        repository_log = _repository_logs.get(repository_path)
+        if repository_log is None:
+            repository_log = _repository_logs[repository_path] = RepositoryLog(repository_path)
+    return repository_log.log(local_client, filepaths, limit=limit)